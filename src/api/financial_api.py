@@ -7,7 +7,6 @@ This module provides integration with financial data APIs for the Open Manus AI
 import os
 import logging
 import requests
-import pandas as pd
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
@@ -112,6 +111,9 @@ class FinancialDataAPI:
             
             time_series = data[time_series_key]
             
+            # Import pandas lazily so the quote/news endpoints don't pay for it
+            import pandas as pd
+            
             # Convert to pandas DataFrame for easier processing
             df = pd.DataFrame.from_dict(time_series, orient="index")
             
@@ -76,6 +76,7 @@ class NewsAPI:
             formatted_articles = []
             
             for article in articles:
+                source = article.get("source") or {}
                 formatted_article = {
                     "title": article.get("title", ""),
                     "description": article.get("description", ""),
@@ -83,8 +84,8 @@ class NewsAPI:
                     "url": article.get("url", ""),
                     "image_url": article.get("urlToImage", ""),
                     "source": {
-                        "name": article.get("source", {}).get("name", ""),
-                        "id": article.get("source", {}).get("id", "")
+                        "name": source.get("name", ""),
+                        "id": source.get("id", "")
                     },
                     "author": article.get("author", ""),
                     "published_at": article.get("publishedAt", "")
@@ -159,6 +160,7 @@ class NewsAPI:
             formatted_articles = []
             
             for article in articles:
+                source = article.get("source") or {}
                 formatted_article = {
                     "title": article.get("title", ""),
                     "description": article.get("description", ""),
@@ -166,8 +168,8 @@ class NewsAPI:
                     "url": article.get("url", ""),
                     "image_url": article.get("urlToImage", ""),
                     "source": {
-                        "name": article.get("source", {}).get("name", ""),
-                        "id": article.get("source", {}).get("id", "")
+                        "name": source.get("name", ""),
+                        "id": source.get("id", "")
                     },
                     "author": article.get("author", ""),
                     "published_at": article.get("publishedAt", "")
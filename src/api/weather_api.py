@@ -16,6 +16,29 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+def _parse_coordinates(location):
+    """
+    Parse a "lat,lon" location string.
+    
+    Args:
+        location (str): Location string
+        
+    Returns:
+        tuple: (lat, lon) as stripped strings, or None if location is not a coordinate pair
+    """
+    parts = location.split(",")
+    if len(parts) != 2:
+        return None
+    
+    lat, lon = parts[0].strip(), parts[1].strip()
+    try:
+        float(lat)
+        float(lon)
+    except ValueError:
+        return None
+    
+    return lat, lon
+
 class WeatherAPI:
     """
     Weather API integration for accessing weather data and forecasts.
@@ -46,13 +69,14 @@ class WeatherAPI:
                 return {"success": False, "error": "OpenWeather API key not configured"}
             
             # Determine if location is coordinates or city name
-            if "," in location and all(part.replace("-", "").replace(".", "").isdigit() for part in location.split(",")):
+            coordinates = _parse_coordinates(location)
+            if coordinates:
                 # Location is coordinates
-                lat, lon = location.split(",")
+                lat, lon = coordinates
                 url = f"https://api.openweathermap.org/data/2.5/weather"
                 params = {
-                    "lat": lat.strip(),
-                    "lon": lon.strip(),
+                    "lat": lat,
+                    "lon": lon,
                     "units": units,
                     "appid": self.openweather_key
                 }
@@ -73,36 +97,43 @@ class WeatherAPI:
             if data.get("cod") != 200:
                 return {"success": False, "error": data.get("message", "Unknown error")}
             
+            # Look up each nested section once
+            sys_info = data.get("sys", {})
+            coord = data.get("coord", {})
+            condition = data.get("weather", [{}])[0]
+            main = data.get("main", {})
+            wind = data.get("wind", {})
+            
             # Process and format the data
             weather_data = {
                 "location": {
                     "name": data.get("name", ""),
-                    "country": data.get("sys", {}).get("country", ""),
+                    "country": sys_info.get("country", ""),
                     "coordinates": {
-                        "lat": data.get("coord", {}).get("lat", 0),
-                        "lon": data.get("coord", {}).get("lon", 0)
+                        "lat": coord.get("lat", 0),
+                        "lon": coord.get("lon", 0)
                     }
                 },
                 "weather": {
-                    "condition": data.get("weather", [{}])[0].get("main", ""),
-                    "description": data.get("weather", [{}])[0].get("description", ""),
-                    "icon": data.get("weather", [{}])[0].get("icon", ""),
+                    "condition": condition.get("main", ""),
+                    "description": condition.get("description", ""),
+                    "icon": condition.get("icon", ""),
                     "temperature": {
-                        "current": data.get("main", {}).get("temp", 0),
-                        "feels_like": data.get("main", {}).get("feels_like", 0),
-                        "min": data.get("main", {}).get("temp_min", 0),
-                        "max": data.get("main", {}).get("temp_max", 0)
+                        "current": main.get("temp", 0),
+                        "feels_like": main.get("feels_like", 0),
+                        "min": main.get("temp_min", 0),
+                        "max": main.get("temp_max", 0)
                     },
-                    "humidity": data.get("main", {}).get("humidity", 0),
-                    "pressure": data.get("main", {}).get("pressure", 0),
+                    "humidity": main.get("humidity", 0),
+                    "pressure": main.get("pressure", 0),
                     "wind": {
-                        "speed": data.get("wind", {}).get("speed", 0),
-                        "direction": data.get("wind", {}).get("deg", 0)
+                        "speed": wind.get("speed", 0),
+                        "direction": wind.get("deg", 0)
                     },
                     "clouds": data.get("clouds", {}).get("all", 0),
                     "visibility": data.get("visibility", 0),
-                    "sunrise": datetime.fromtimestamp(data.get("sys", {}).get("sunrise", 0)).isoformat(),
-                    "sunset": datetime.fromtimestamp(data.get("sys", {}).get("sunset", 0)).isoformat()
+                    "sunrise": datetime.fromtimestamp(sys_info.get("sunrise", 0)).isoformat(),
+                    "sunset": datetime.fromtimestamp(sys_info.get("sunset", 0)).isoformat()
                 },
                 "units": units,
                 "timestamp": datetime.now().isoformat()
@@ -135,13 +166,14 @@ class WeatherAPI:
                 return {"success": False, "error": "OpenWeather API key not configured"}
             
             # Determine if location is coordinates or city name
-            if "," in location and all(part.replace("-", "").replace(".", "").isdigit() for part in location.split(",")):
+            coordinates = _parse_coordinates(location)
+            if coordinates:
                 # Location is coordinates
-                lat, lon = location.split(",")
+                lat, lon = coordinates
                 url = f"https://api.openweathermap.org/data/2.5/forecast"
                 params = {
-                    "lat": lat.strip(),
-                    "lon": lon.strip(),
+                    "lat": lat,
+                    "lon": lon,
                     "units": units,
                     "appid": self.openweather_key
                 }
@@ -163,12 +195,14 @@ class WeatherAPI:
                 return {"success": False, "error": data.get("message", "Unknown error")}
             
             # Process and format the data
+            city = data.get("city", {})
+            city_coord = city.get("coord", {})
             location_data = {
-                "name": data.get("city", {}).get("name", ""),
-                "country": data.get("city", {}).get("country", ""),
+                "name": city.get("name", ""),
+                "country": city.get("country", ""),
                 "coordinates": {
-                    "lat": data.get("city", {}).get("coord", {}).get("lat", 0),
-                    "lon": data.get("city", {}).get("coord", {}).get("lon", 0)
+                    "lat": city_coord.get("lat", 0),
+                    "lon": city_coord.get("lon", 0)
                 }
             }
             
@@ -181,24 +215,28 @@ class WeatherAPI:
                 if day_key not in forecast_by_day:
                     forecast_by_day[day_key] = []
                 
+                main = item.get("main", {})
+                condition = item.get("weather", [{}])[0]
+                wind = item.get("wind", {})
+                
                 forecast_item = {
                     "datetime": dt.isoformat(),
                     "temperature": {
-                        "current": item.get("main", {}).get("temp", 0),
-                        "feels_like": item.get("main", {}).get("feels_like", 0),
-                        "min": item.get("main", {}).get("temp_min", 0),
-                        "max": item.get("main", {}).get("temp_max", 0)
+                        "current": main.get("temp", 0),
+                        "feels_like": main.get("feels_like", 0),
+                        "min": main.get("temp_min", 0),
+                        "max": main.get("temp_max", 0)
                     },
                     "weather": {
-                        "condition": item.get("weather", [{}])[0].get("main", ""),
-                        "description": item.get("weather", [{}])[0].get("description", ""),
-                        "icon": item.get("weather", [{}])[0].get("icon", "")
+                        "condition": condition.get("main", ""),
+                        "description": condition.get("description", ""),
+                        "icon": condition.get("icon", "")
                     },
-                    "humidity": item.get("main", {}).get("humidity", 0),
-                    "pressure": item.get("main", {}).get("pressure", 0),
+                    "humidity": main.get("humidity", 0),
+                    "pressure": main.get("pressure", 0),
                     "wind": {
-                        "speed": item.get("wind", {}).get("speed", 0),
-                        "direction": item.get("wind", {}).get("deg", 0)
+                        "speed": wind.get("speed", 0),
+                        "direction": wind.get("deg", 0)
                     },
                     "clouds": item.get("clouds", {}).get("all", 0),
                     "precipitation": {
@@ -246,14 +284,15 @@ class WeatherAPI:
                 return {"success": False, "error": "OpenWeather API key not configured"}
             
             # Location must be coordinates for this API
-            if "," not in location or not all(part.replace("-", "").replace(".", "").isdigit() for part in location.split(",")):
+            coordinates = _parse_coordinates(location)
+            if not coordinates:
                 return {"success": False, "error": "Location must be coordinates (lat,lon) for air pollution data"}
             
-            lat, lon = location.split(",")
+            lat, lon = coordinates
             url = f"https://api.openweathermap.org/data/2.5/air_pollution"
             params = {
-                "lat": lat.strip(),
-                "lon": lon.strip(),
+                "lat": lat,
+                "lon": lon,
                 "appid": self.openweather_key
             }
             
@@ -281,6 +320,7 @@ class WeatherAPI:
             }
             
             aqi = pollution_data.get("main", {}).get("aqi", 0)
+            components = pollution_data.get("components", {})
             
             formatted_data = {
                 "location": {
@@ -293,14 +333,14 @@ class WeatherAPI:
                     "aqi": aqi,
                     "description": aqi_descriptions.get(aqi, "Unknown"),
                     "components": {
-                        "co": pollution_data.get("components", {}).get("co", 0),
-                        "no": pollution_data.get("components", {}).get("no", 0),
-                        "no2": pollution_data.get("components", {}).get("no2", 0),
-                        "o3": pollution_data.get("components", {}).get("o3", 0),
-                        "so2": pollution_data.get("components", {}).get("so2", 0),
-                        "pm2_5": pollution_data.get("components", {}).get("pm2_5", 0),
-                        "pm10": pollution_data.get("components", {}).get("pm10", 0),
-                        "nh3": pollution_data.get("components", {}).get("nh3", 0)
+                        "co": components.get("co", 0),
+                        "no": components.get("no", 0),
+                        "no2": components.get("no2", 0),
+                        "o3": components.get("o3", 0),
+                        "so2": components.get("so2", 0),
+                        "pm2_5": components.get("pm2_5", 0),
+                        "pm10": components.get("pm10", 0),
+                        "nh3": components.get("nh3", 0)
                     }
                 },
                 "timestamp": datetime.fromtimestamp(pollution_data.get("dt", 0)).isoformat()
@@ -5,26 +5,52 @@ This module handles the secure storage and retrieval of user memory and context
 for personalized interactions in Open Manus AI.
 """
 
-import os
+import time
 import json
+import atexit
 import logging
+import sqlite3
 import datetime
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
+import orjson
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def _encode_value(value):
+    """
+    Serialize a memory value for storage.
+    
+    Writes use the json module, as earlier versions did: unlike orjson it accepts
+    numpy floats and keeps NaN/Infinity instead of silently turning them into null.
+    """
+    return json.dumps(value)
+
+def _decode_value(value_json):
+    """Deserialize a stored memory value, falling back to json for NaN/Infinity tokens orjson rejects."""
+    try:
+        return orjson.loads(value_json)
+    except orjson.JSONDecodeError:
+        return json.loads(value_json)
+
 class MemoryManager:
     """
     Memory Manager class that handles secure storage and retrieval of user data.
     """
     
-    def __init__(self, storage_dir=None):
+    def __init__(self, storage_dir=None, cache_size=1024, cache_ttl=300, flush_interval=0.25, flush_threshold=64):
         """
         Initialize the Memory Manager with storage location.
         
         Args:
             storage_dir (str, optional): Directory to store memory data
+            cache_size (int, optional): Maximum number of users kept in the memory cache
+            cache_ttl (int, optional): Seconds before a cached user is re-read from the database
+            flush_interval (float, optional): Seconds buffered writes wait before being committed
+            flush_threshold (int, optional): Number of buffered writes that triggers an immediate commit
         """
         if storage_dir:
             self.storage_dir = Path(storage_dir)
@@ -34,11 +60,157 @@ class MemoryManager:
         # Create storage directory if it doesn't exist
         self.storage_dir.mkdir(parents=True, exist_ok=True)
         
-        # Initialize memory cache
-        self.memory_cache = {}
+        # Open the shared memory database (one connection, serialized by db_lock)
+        self.db_path = self.storage_dir / "memory.db"
+        self.db = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None, timeout=5)
+        self.db_lock = threading.Lock()
+        self._init_db()
+        
+        # Initialize memory cache (user_id -> (load time, {key: JSON text}, fully loaded), LRU ordered).
+        # Values stay encoded so every read decodes a fresh object callers can't mutate the cache through.
+        self.memory_cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache_lock = threading.Lock()
+        
+        # user_id -> [loads in flight, write generation] while get_all_memory reads the database
+        self._loads = {}
+        
+        # Write-behind buffer ((user_id, key) -> (value, timestamp)), committed in batches
+        self.pending_writes = {}
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.write_lock = threading.Lock()
+        self._flush_timer = None
+        atexit.register(self.flush)
         
         logger.info(f"Memory Manager initialized with storage at {self.storage_dir}")
     
+    def _init_db(self):
+        """
+        Configure the database connection, create the schema and import legacy JSON memory files.
+        """
+        with self.db_lock:
+            # WAL lets the Streamlit and Telegram processes read while the other writes
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("PRAGMA temp_store=MEMORY")
+            self.db.execute("PRAGMA busy_timeout=5000")
+            
+            # The (user_id, key) primary key doubles as the lookup index
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS memory ("
+                "user_id TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "value TEXT NOT NULL, "
+                "timestamp TEXT NOT NULL, "
+                "PRIMARY KEY (user_id, key)"
+                ") WITHOUT ROWID"
+            )
+        
+        self._migrate_json_files()
+    
+    def _migrate_json_files(self):
+        """
+        Import per-user memory.json files written by earlier versions into the database.
+        
+        Each imported file is renamed to memory.json.migrated so it is only imported once.
+        """
+        for memory_file in self.storage_dir.glob("*/memory.json"):
+            user_id = memory_file.parent.name
+            try:
+                # Legacy files were written by json.dump and may contain NaN/Infinity, which orjson rejects
+                with open(memory_file, "r") as f:
+                    memory_data = json.load(f)
+                
+                rows = [
+                    (user_id, key, _encode_value(item["value"]), item.get("timestamp", ""))
+                    for key, item in memory_data.items()
+                ]
+                
+                with self.db_lock:
+                    self.db.execute("BEGIN IMMEDIATE")
+                    try:
+                        # Rows already in the database are newer than the legacy file
+                        self.db.executemany(
+                            "INSERT OR IGNORE INTO memory (user_id, key, value, timestamp) VALUES (?, ?, ?, ?)",
+                            rows
+                        )
+                        self.db.execute("COMMIT")
+                    except Exception:
+                        self.db.execute("ROLLBACK")
+                        raise
+                
+                memory_file.rename(memory_file.with_name("memory.json.migrated"))
+                logger.info(f"Migrated {len(rows)} memory items for user {user_id} to {self.db_path}")
+                
+            except Exception as e:
+                logger.error(f"Error migrating memory file {memory_file}: {e}")
+    
+    def flush(self):
+        """
+        Commit all buffered memory writes to the database in one transaction.
+        
+        Returns:
+            bool: Success status
+        """
+        # Hold db_lock across the swap so batches are committed in the order they were taken
+        with self.db_lock:
+            with self.write_lock:
+                batch = self.pending_writes
+                self.pending_writes = {}
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+            
+            if not batch:
+                return True
+            
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO memory (user_id, key, value, timestamp) VALUES (?, ?, ?, ?)",
+                        [(user_id, key, value, timestamp) for (user_id, key), (value, timestamp) in batch.items()]
+                    )
+                    self.db.execute("COMMIT")
+                except sqlite3.Error:
+                    self.db.execute("ROLLBACK")
+                    raise
+                
+                logger.debug(f"Flushed {len(batch)} buffered memory writes")
+                return True
+                
+            except sqlite3.Error as e:
+                logger.error(f"Error flushing memory writes: {e}")
+                
+                # Re-queue the batch for the next flush without clobbering newer writes
+                with self.write_lock:
+                    for item_key, item in batch.items():
+                        self.pending_writes.setdefault(item_key, item)
+                    self._schedule_flush()
+                
+                return False
+    
+    def _schedule_flush(self):
+        """
+        Start the flush timer if one is not already pending.
+        
+        Must be called with write_lock held.
+        """
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def close(self):
+        """
+        Flush buffered writes and close the memory database connection.
+        """
+        self.flush()
+        with self.db_lock:
+            self.db.close()
+    
     def save_memory(self, user_id, key, value):
         """
         Save a memory item for a specific user.
@@ -52,37 +224,28 @@ class MemoryManager:
             bool: Success status
         """
         try:
-            # Create user directory if it doesn't exist
-            user_dir = self.storage_dir / user_id
-            user_dir.mkdir(exist_ok=True)
-            
-            # Load existing memory file if it exists
-            memory_file = user_dir / "memory.json"
-            if memory_file.exists():
-                with open(memory_file, "r") as f:
-                    memory_data = json.load(f)
-            else:
-                memory_data = {}
-            
-            # Update memory with new value
-            memory_data[key] = {
-                "value": value,
-                "timestamp": datetime.datetime.now().isoformat()
-            }
-            
-            # Save updated memory
-            with open(memory_file, "w") as f:
-                json.dump(memory_data, f, indent=2)
+            # Buffer the upsert; bursts of saves are committed together by flush()
+            value_json = _encode_value(value)
+            timestamp = datetime.datetime.now().isoformat()
+            with self.write_lock:
+                self.pending_writes[(user_id, key)] = (value_json, timestamp)
+                flush_now = len(self.pending_writes) >= self.flush_threshold
+                if not flush_now:
+                    self._schedule_flush()
             
             # Update cache
-            if user_id not in self.memory_cache:
-                self.memory_cache[user_id] = {}
-            self.memory_cache[user_id][key] = value
+            with self.cache_lock:
+                self._cache_user(user_id)[key] = value_json
+                self._bump_generation(user_id)
+            
+            # A failed flush re-queues the write, but it isn't persisted yet
+            if flush_now and not self.flush():
+                return False
             
             logger.debug(f"Memory saved for user {user_id}: {key}")
             return True
             
-        except Exception as e:
+        except (sqlite3.Error, TypeError, ValueError) as e:
             logger.error(f"Error saving memory for user {user_id}: {e}")
             return False
     
@@ -96,38 +259,22 @@ class MemoryManager:
             default (any, optional): Default value if memory item doesn't exist
             
         Returns:
-            any: The memory item value or default if not found
+            any: The memory item value (a fresh copy) or default if not found
         """
         # Check cache first
-        if user_id in self.memory_cache and key in self.memory_cache[user_id]:
-            return self.memory_cache[user_id][key]
+        with self.cache_lock:
+            complete_cache = self._get_cached_user(user_id, complete=True)
+            user_cache = complete_cache if complete_cache is not None else self._get_cached_user(user_id)
+            value_json = user_cache.get(key) if user_cache is not None else None
         
-        try:
-            # Check if user memory file exists
-            memory_file = self.storage_dir / user_id / "memory.json"
-            if not memory_file.exists():
-                return default
-            
-            # Load memory data
-            with open(memory_file, "r") as f:
-                memory_data = json.load(f)
-            
-            # Get memory item if it exists
-            if key in memory_data:
-                value = memory_data[key]["value"]
-                
-                # Update cache
-                if user_id not in self.memory_cache:
-                    self.memory_cache[user_id] = {}
-                self.memory_cache[user_id][key] = value
-                
-                return value
-            else:
-                return default
-                
-        except Exception as e:
-            logger.error(f"Error retrieving memory for user {user_id}: {e}")
+        # Decode outside the lock; each call gets its own copy of the value
+        if value_json is not None:
+            return _decode_value(value_json)
+        if complete_cache is not None:
             return default
+        
+        # Load all of the user's items once so later lookups hit the cache
+        return self.get_all_memory(user_id).get(key, default)
     
     def delete_memory(self, user_id, key=None):
         """
@@ -141,46 +288,45 @@ class MemoryManager:
             bool: Success status
         """
         try:
-            memory_file = self.storage_dir / user_id / "memory.json"
+            # Hold db_lock so no flush is mid-batch (and able to re-queue) while
+            # buffered writes for the deleted items are discarded
+            with self.db_lock:
+                with self.write_lock:
+                    if key is None:
+                        dropped = [item_key for item_key in self.pending_writes if item_key[0] == user_id]
+                    else:
+                        dropped = [(user_id, key)] if (user_id, key) in self.pending_writes else []
+                    for item_key in dropped:
+                        del self.pending_writes[item_key]
+                
+                # If key is None, delete all memory for the user
+                if key is None:
+                    cursor = self.db.execute("DELETE FROM memory WHERE user_id = ?", (user_id,))
+                else:
+                    cursor = self.db.execute("DELETE FROM memory WHERE user_id = ? AND key = ?", (user_id, key))
+            
+            # Update cache
+            with self.cache_lock:
+                if key is None:
+                    self.memory_cache.pop(user_id, None)
+                else:
+                    user_cache = self._get_cached_user(user_id)
+                    if user_cache is not None:
+                        user_cache.pop(key, None)
+                self._bump_generation(user_id)
             
-            # If key is None, delete all memory for the user
             if key is None:
-                if memory_file.exists():
-                    memory_file.unlink()
-                
-                # Clear cache for user
-                if user_id in self.memory_cache:
-                    del self.memory_cache[user_id]
-                
                 logger.info(f"All memory deleted for user {user_id}")
                 return True
             
-            # Otherwise, delete specific memory item
-            if not memory_file.exists():
-                return False
-            
-            # Load memory data
-            with open(memory_file, "r") as f:
-                memory_data = json.load(f)
-            
-            # Remove memory item if it exists
-            if key in memory_data:
-                del memory_data[key]
-                
-                # Save updated memory
-                with open(memory_file, "w") as f:
-                    json.dump(memory_data, f, indent=2)
-                
-                # Update cache
-                if user_id in self.memory_cache and key in self.memory_cache[user_id]:
-                    del self.memory_cache[user_id][key]
-                
+            # The item existed if it was in the database or only buffered
+            if cursor.rowcount > 0 or dropped:
                 logger.debug(f"Memory item {key} deleted for user {user_id}")
                 return True
             else:
                 return False
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Error deleting memory for user {user_id}: {e}")
             return False
     
@@ -192,25 +338,146 @@ class MemoryManager:
             user_id (str): Unique identifier for the user
             
         Returns:
-            dict: All memory items for the user
+            dict: All memory items for the user (fresh copies)
         """
+        # Check cache first
+        with self.cache_lock:
+            user_cache = self._get_cached_user(user_id, complete=True)
+            if user_cache is not None:
+                user_cache = dict(user_cache)
+            else:
+                start_generation = self._begin_load(user_id)
+        
+        if user_cache is not None:
+            return {k: _decode_value(v) for k, v in user_cache.items()}
+        
+        loaded = None
         try:
-            memory_file = self.storage_dir / user_id / "memory.json"
-            if not memory_file.exists():
-                return {}
-            
-            # Load memory data
-            with open(memory_file, "r") as f:
-                memory_data = json.load(f)
+            # Make sure buffered writes are visible to the query
+            self.flush()
             
-            # Extract just the values (not timestamps)
-            result = {k: v["value"] for k, v in memory_data.items()}
+            with self.db_lock:
+                cursor = self.db.execute("SELECT key, value FROM memory WHERE user_id = ?", (user_id,))
+                rows = dict(cursor)
             
-            # Update cache
-            self.memory_cache[user_id] = result
+            # Decode before caching so a corrupt row is never cached
+            result = {k: _decode_value(v) for k, v in rows.items()}
+            loaded = rows
             
             return result
                 
-        except Exception as e:
+        except (sqlite3.Error, json.JSONDecodeError) as e:
             logger.error(f"Error retrieving all memory for user {user_id}: {e}")
             return {}
+        
+        finally:
+            with self.cache_lock:
+                self._end_load(user_id, start_generation, loaded)
+    
+    def _begin_load(self, user_id):
+        """
+        Register a database load for a user so concurrent writes can be detected.
+        
+        Must be called with cache_lock held.
+        
+        Args:
+            user_id (str): Unique identifier for the user
+            
+        Returns:
+            int: The user's write generation when the load started
+        """
+        entry = self._loads.setdefault(user_id, [0, 0])
+        entry[0] += 1
+        return entry[1]
+    
+    def _end_load(self, user_id, start_generation, items):
+        """
+        Finish a database load, caching its snapshot only if no write raced with it.
+        
+        A save or delete that lands after the SELECT has already updated the cache
+        entry; replacing that entry with the older snapshot would hide it until the TTL.
+        
+        Must be called with cache_lock held.
+        
+        Args:
+            user_id (str): Unique identifier for the user
+            start_generation (int): Value returned by _begin_load
+            items (dict): JSON-encoded items read from the database, or None if the load failed
+        """
+        entry = self._loads[user_id]
+        if items is not None and entry[1] == start_generation:
+            self._cache_user(user_id, items)
+        
+        entry[0] -= 1
+        if entry[0] == 0:
+            del self._loads[user_id]
+    
+    def _bump_generation(self, user_id):
+        """
+        Record a write for a user so in-flight loads don't cache a stale snapshot.
+        
+        Must be called with cache_lock held.
+        
+        Args:
+            user_id (str): Unique identifier for the user
+        """
+        entry = self._loads.get(user_id)
+        if entry is not None:
+            entry[1] += 1
+    
+    def _get_cached_user(self, user_id, complete=False):
+        """
+        Return the cached memory items for a user if present and fresh.
+        
+        Must be called with cache_lock held.
+        
+        Args:
+            user_id (str): Unique identifier for the user
+            complete (bool, optional): Only return items if the user's whole file was loaded
+            
+        Returns:
+            dict: Cached JSON-encoded memory items, or None if missing or expired
+        """
+        entry = self.memory_cache.get(user_id)
+        if entry is None:
+            return None
+        
+        loaded_at, items, fully_loaded = entry
+        if time.monotonic() - loaded_at > self.cache_ttl:
+            # Another process may have written to the database since we loaded
+            del self.memory_cache[user_id]
+            return None
+        
+        if complete and not fully_loaded:
+            return None
+        
+        self.memory_cache.move_to_end(user_id)
+        return items
+    
+    def _cache_user(self, user_id, items=None):
+        """
+        Get or create the cache entry for a user, evicting the least recently used.
+        
+        Must be called with cache_lock held.
+        
+        Args:
+            user_id (str): Unique identifier for the user
+            items (dict, optional): Full set of JSON-encoded memory items to cache for the user
+            
+        Returns:
+            dict: The cached JSON-encoded memory items for the user
+        """
+        fully_loaded = items is not None
+        if not fully_loaded:
+            cached = self._get_cached_user(user_id)
+            if cached is not None:
+                return cached
+            items = {}
+        
+        self.memory_cache[user_id] = (time.monotonic(), items, fully_loaded)
+        self.memory_cache.move_to_end(user_id)
+        
+        while len(self.memory_cache) > self.cache_size:
+            self.memory_cache.popitem(last=False)
+        
+        return items
@@ -7,10 +7,7 @@ This module implements a web-based dashboard using Streamlit for the Open Manus
 import os
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import time
 from datetime import datetime, timedelta
-import json
 import sys
 from pathlib import Path
 
@@ -192,11 +189,11 @@ elif st.session_state.current_tab == "financial":
                         chart_result = components["financial_analysis"].generate_stock_chart(
                             symbol, 
                             period=period,
-                            output_dir="/tmp"
+                            in_memory=True
                         )
                         
                         if chart_result.get('success', False):
-                            st.image(chart_result['filepath'])
+                            st.image(chart_result['image'])
                         else:
                             st.error(f"Error generating chart: {chart_result.get('error', 'Unknown error')}")
                 
@@ -5,9 +5,17 @@ This module implements a Telegram bot interface for the Open Manus AI system.
 """
 
 import os
+import re
+import time
 import logging
+import numbers
 import asyncio
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatAction
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from dotenv import load_dotenv
 import sys
@@ -39,14 +47,349 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Seconds between sweeps of idle user states
+USER_STATE_GC_INTERVAL = 900
+
+# Telegram's global limit on outgoing messages per second
+MAX_MESSAGES_PER_SECOND = 30
+
+# Telegram's per-chat limit (about one message per second, short bursts tolerated)
+CHAT_MESSAGES_PER_SECOND = 1
+CHAT_MESSAGE_BURST = 5
+
+# Emoji for a price move, indexed by bool(change >= 0) (numpy comparisons return numpy.bool, which is not an index)
+SIGN_EMOJI = ("🔴", "🟢")
+
+# Forecast condition keywords and their emoji, in priority order
+CONDITION_EMOJI = (
+    ("rain", "🌧️"),
+    ("cloud", "☁️"),
+    ("snow", "❄️"),
+    ("storm", "⛈️"),
+    ("thunder", "⛈️")
+)
+
+# Parameterized callback data is "<prefix>_<argument>"; longer prefixes are listed before their shorter forms
+CALLBACK_PATTERN = re.compile(
+    r"^(analyze_stock|analyze|mode|code|forecast|news|summarize|settings|set)(?:_(.*))?$",
+    re.DOTALL
+)
+
+# Static message texts
+WELCOME_TEMPLATE = (
+    "👋 Hello, {first_name}! I'm Open Manus AI, your personal AI assistant.\n\n"
+    "I can help you with:\n"
+    "• 💬 Conversations and questions\n"
+    "• 📈 Financial analysis\n"
+    "• 💻 Coding support\n"
+    "• 🌤️ Weather information\n"
+    "• 📰 News updates\n\n"
+    "Use /help to see all available commands."
+)
+
+HELP_TEXT = (
+    "🤖 *Open Manus AI Commands*\n\n"
+    "*Basic Commands:*\n"
+    "/start - Start the bot and see main menu\n"
+    "/help - Show this help message\n"
+    "/chat - Enter chat mode\n"
+    "/reset - Reset conversation history\n\n"
+    
+    "*Feature Commands:*\n"
+    "/finance <symbol> - Get financial data for a stock\n"
+    "/code <language> - Generate code (follow with your description)\n"
+    "/weather <location> - Get weather forecast\n"
+    "/news <topic> - Get latest news\n\n"
+    
+    "*Advanced Commands:*\n"
+    "/analyze_code - Analyze code (send code after this command)\n"
+    "/analyze_stock <symbol> - Get detailed stock analysis\n"
+    "/market - Get market overview\n"
+    "/task <description> - Create a task\n\n"
+    
+    "*Settings:*\n"
+    "/settings - View and change settings\n"
+    "/feedback - Send feedback about the bot\n"
+)
+
+FINANCE_HELP_TEXT = (
+    "📈 *Financial Analysis*\n\n"
+    "Please provide a stock symbol to get financial data.\n"
+    "Example: `/finance AAPL`\n\n"
+    "Or use one of these options:"
+)
+
+def _fmt_number(value):
+    """Format a number with two decimals, or N/A if it is missing."""
+    return f"{value:.2f}" if isinstance(value, numbers.Real) else "N/A"
+
+def _fmt_money(value):
+    """Format a price as $1,234.56, or N/A if it is missing."""
+    return f"${value:,.2f}" if isinstance(value, numbers.Real) else "N/A"
+
+def _fmt_pct(value):
+    """Format a percentage with two decimals, or N/A if it is missing."""
+    return f"{value:.2f}%" if isinstance(value, numbers.Real) else "N/A"
+
+def _sign_emoji(value):
+    """Pick the price move emoji for a change, treating a missing change as flat."""
+    return SIGN_EMOJI[bool((value or 0.0) >= 0)]
+
+def _language_keyboard(prefix):
+    """Build the programming language picker, with callback data prefixed by prefix."""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("Python", callback_data=f"{prefix}_python"),
+            InlineKeyboardButton("JavaScript", callback_data=f"{prefix}_javascript"),
+            InlineKeyboardButton("Java", callback_data=f"{prefix}_java")
+        ],
+        [
+            InlineKeyboardButton("C++", callback_data=f"{prefix}_cpp"),
+            InlineKeyboardButton("HTML/CSS", callback_data=f"{prefix}_html"),
+            InlineKeyboardButton("SQL", callback_data=f"{prefix}_sql")
+        ]
+    ])
+
+# Static keyboards, built once (telegram objects are immutable, so they can be shared)
+START_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("💬 Chat", callback_data="mode_chat"),
+        InlineKeyboardButton("📈 Finance", callback_data="mode_finance")
+    ],
+    [
+        InlineKeyboardButton("💻 Code", callback_data="mode_code"),
+        InlineKeyboardButton("🌤️ Weather", callback_data="mode_weather"),
+        InlineKeyboardButton("📰 News", callback_data="mode_news")
+    ]
+])
+
+FINANCE_OPTIONS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Market Overview", callback_data="market_overview"),
+        InlineKeyboardButton("Top Stocks", callback_data="top_stocks")
+    ]
+])
+
+CODE_LANGUAGE_KEYBOARD = _language_keyboard("code")
+ANALYZE_LANGUAGE_KEYBOARD = _language_keyboard("analyze")
+
+NEWS_CATEGORY_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Top Headlines", callback_data="news_headlines"),
+        InlineKeyboardButton("Business", callback_data="news_business")
+    ],
+    [
+        InlineKeyboardButton("Technology", callback_data="news_technology"),
+        InlineKeyboardButton("Science", callback_data="news_science")
+    ],
+    [
+        InlineKeyboardButton("Health", callback_data="news_health"),
+        InlineKeyboardButton("Sports", callback_data="news_sports")
+    ]
+])
+
+SETTINGS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Change Language", callback_data="settings_language"),
+        InlineKeyboardButton("Change Units", callback_data="settings_units")
+    ],
+    [
+        InlineKeyboardButton("Change News Country", callback_data="settings_news_country"),
+        InlineKeyboardButton("Reset All Settings", callback_data="settings_reset")
+    ]
+])
+
+LANGUAGE_SETTINGS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("English", callback_data="set_language_english"),
+        InlineKeyboardButton("Spanish", callback_data="set_language_spanish")
+    ],
+    [
+        InlineKeyboardButton("French", callback_data="set_language_french"),
+        InlineKeyboardButton("German", callback_data="set_language_german")
+    ]
+])
+
+UNITS_SETTINGS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Metric (°C, m/s)", callback_data="set_units_metric"),
+        InlineKeyboardButton("Imperial (°F, mph)", callback_data="set_units_imperial")
+    ]
+])
+
+NEWS_COUNTRY_SETTINGS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("US", callback_data="set_news_country_us"),
+        InlineKeyboardButton("UK", callback_data="set_news_country_gb"),
+        InlineKeyboardButton("Canada", callback_data="set_news_country_ca")
+    ],
+    [
+        InlineKeyboardButton("Australia", callback_data="set_news_country_au"),
+        InlineKeyboardButton("India", callback_data="set_news_country_in"),
+        InlineKeyboardButton("Germany", callback_data="set_news_country_de")
+    ]
+])
+
+class UserStateStore:
+    """
+    Bounded, LRU-ordered store of per-user bot states that forgets idle users.
+    """
+    
+    def __init__(self, max_size=10000, ttl=3600):
+        """
+        Initialize the user state store.
+        
+        Args:
+            max_size (int, optional): Maximum number of users tracked at once
+            ttl (int, optional): Seconds of inactivity before a user's state is dropped
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._states = OrderedDict()  # user_id -> (last activity, state)
+    
+    def get(self, user_id, default=None):
+        """
+        Get a user's state and mark the user as active.
+        
+        Args:
+            user_id (str): Unique identifier for the user
+            default (any, optional): Value returned if the user has no live state
+            
+        Returns:
+            any: The user's state or default
+        """
+        entry = self._states.get(user_id)
+        if entry is None:
+            return default
+        
+        now = time.monotonic()
+        if now - entry[0] > self.ttl:
+            del self._states[user_id]
+            return default
+        
+        self._states[user_id] = (now, entry[1])
+        self._states.move_to_end(user_id)
+        return entry[1]
+    
+    def __setitem__(self, user_id, state):
+        """Set a user's state, evicting the least recently active users if full."""
+        self._states[user_id] = (time.monotonic(), state)
+        self._states.move_to_end(user_id)
+        
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+    
+    def __len__(self):
+        return len(self._states)
+    
+    def expire(self):
+        """
+        Drop the states of all users idle for longer than the TTL.
+        
+        Returns:
+            int: Number of states dropped
+        """
+        # Entries are ordered by last activity, so stop at the first live one
+        cutoff = time.monotonic() - self.ttl
+        expired = 0
+        while self._states:
+            user_id, (last_activity, _) = next(iter(self._states.items()))
+            if last_activity > cutoff:
+                break
+            del self._states[user_id]
+            expired += 1
+        return expired
+
+class RateLimiter:
+    """
+    Token bucket that paces outgoing messages to a fixed rate with bursts.
+    """
+    
+    def __init__(self, rate=MAX_MESSAGES_PER_SECOND, capacity=MAX_MESSAGES_PER_SECOND):
+        """
+        Initialize the rate limiter.
+        
+        Args:
+            rate (float, optional): Tokens added per second
+            capacity (int, optional): Maximum burst size
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None  # Created on first use, inside the running event loop
+    
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for a while, e.g. after Telegram reports flood control.
+        
+        Args:
+            seconds (float): How long to hold all callers
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def is_idle(self):
+        """
+        Check whether the limiter can be dropped without affecting pacing.
+        
+        Returns:
+            bool: True if nobody is waiting and the bucket has refilled, so a new
+                limiter would behave the same
+        """
+        if self._lock is not None and self._lock.locked():
+            return False
+        
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        return self._tokens + (now - self._updated) * self.rate >= self.capacity
+    
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
 class TelegramBot:
     """
     Telegram Bot interface for Open Manus AI.
     """
     
-    def __init__(self):
-        """Initialize the Telegram Bot interface."""
+    def __init__(self, connection_pool_size=256, pool_timeout=10.0, connect_timeout=10.0, read_timeout=30.0,
+                 concurrent_updates=256, ai_workers=8):
+        """
+        Initialize the Telegram Bot interface.
+        
+        Args:
+            connection_pool_size (int, optional): HTTP connections shared by all Bot API calls
+            pool_timeout (float, optional): Seconds to wait for a free connection
+            connect_timeout (float, optional): Seconds to wait for a connection to be established
+            read_timeout (float, optional): Seconds to wait for a Bot API response
+            concurrent_updates (int, optional): Maximum number of updates processed at once
+            ai_workers (int, optional): Threads reserved for AI engine calls
+        """
         self.token = os.getenv("TELEGRAM_BOT_TOKEN")
+        self.connection_pool_size = connection_pool_size
+        self.pool_timeout = pool_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.concurrent_updates = concurrent_updates
         
         if not self.token:
             logger.error("Telegram bot token not found in environment variables")
@@ -67,110 +410,140 @@ class TelegramBot:
         self.weather_api = WeatherAPI()
         self.news_api = NewsAPI()
         
-        # User states
-        self.user_states = {}
+        # User states (bounded, idle users fall back to chat mode)
+        self.user_states = UserStateStore()
+        
+        # Outgoing message pacing (Telegram allows ~30 messages per second per bot)
+        self.send_limiter = RateLimiter()
+        
+        # AI calls get their own bounded pool so slow completions can't starve the
+        # default executor used for memory, market data and weather lookups
+        self._ai_pool = ThreadPoolExecutor(max_workers=ai_workers, thread_name_prefix="ai")
+        
+        # Per-chat pacing (chat_id -> RateLimiter); limiters are dropped once idle
+        self.chat_limiters = {}
+        
+        # Periodic cleanup of idle states, started in _post_init
+        self._expire_task = None
+        
+        # Callback data without an argument -> handler (checked before CALLBACK_PATTERN)
+        self._exact_callback_handlers = {
+            "market_overview": self._cb_market_overview
+        }
+        
+        # Callback prefix -> handler (see CALLBACK_PATTERN)
+        self._callback_handlers = {
+            "mode": self._cb_mode,
+            "code": self._cb_code_language,
+            "analyze": self._cb_analyze_language,
+            "analyze_stock": self._cb_analyze_stock,
+            "forecast": self._cb_forecast,
+            "news": self._cb_news,
+            "summarize": self._cb_summarize,
+            "settings": self._cb_settings,
+            "set": self._cb_set
+        }
         
         logger.info("Telegram Bot interface initialized")
     
+    async def _reply(self, message, text, **kwargs):
+        """Reply to a message once the per-chat and global rate limits allow it."""
+        chat_limiter = self.chat_limiters.get(message.chat_id)
+        if chat_limiter is None:
+            chat_limiter = RateLimiter(CHAT_MESSAGES_PER_SECOND, CHAT_MESSAGE_BURST)
+            self.chat_limiters[message.chat_id] = chat_limiter
+        
+        # Wait on the chat first so a busy chat doesn't hold global tokens
+        await chat_limiter.acquire()
+        await self.send_limiter.acquire()
+        try:
+            return await message.reply_text(text, **kwargs)
+        except RetryAfter as e:
+            # Flood control applies to the whole bot, so hold every sender, then retry once
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            
+            logger.warning(f"Telegram flood control, pausing outgoing messages for {retry_after}s")
+            self.send_limiter.pause(retry_after)
+            await self.send_limiter.acquire()
+            return await message.reply_text(text, **kwargs)
+    
+    def _user_id(self, update, context):
+        """
+        Get the sender's id as the string key used by the memory and state stores.
+        
+        The string is built once per user and kept in context.user_data.
+        """
+        user_id = context.user_data.get("user_id")
+        if user_id is None:
+            user_id = context.user_data["user_id"] = str(update.effective_user.id)
+        return user_id
+    
+    async def _run_ai(self, func, *args):
+        """Run a blocking AI engine call on the AI thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._ai_pool, func, *args)
+    
+    def _show_typing(self, context, chat):
+        """
+        Show the typing indicator without waiting for the API call.
+        
+        The indicator is cosmetic, so it is sent in the background while the
+        slow work runs instead of adding a round-trip before the first reply.
+        """
+        context.application.create_task(chat.send_action(ChatAction.TYPING))
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /start command."""
         user = update.effective_user
-        user_id = str(user.id)
+        user_id = self._user_id(update, context)
         
         # Store user info in memory
-        self.memory_manager.save_memory(user_id, "name", user.first_name)
-        self.memory_manager.save_memory(user_id, "username", user.username)
+        await asyncio.to_thread(self.memory_manager.save_memory, user_id, "name", user.first_name)
+        await asyncio.to_thread(self.memory_manager.save_memory, user_id, "username", user.username)
         
         # Welcome message
-        welcome_message = (
-            f"👋 Hello, {user.first_name}! I'm Open Manus AI, your personal AI assistant.\n\n"
-            "I can help you with:\n"
-            "• 💬 Conversations and questions\n"
-            "• 📈 Financial analysis\n"
-            "• 💻 Coding support\n"
-            "• 🌤️ Weather information\n"
-            "• 📰 News updates\n\n"
-            "Use /help to see all available commands."
-        )
+        welcome_message = WELCOME_TEMPLATE.format_map({"first_name": user.first_name})
         
-        # Create keyboard with main features
-        keyboard = [
-            [
-                InlineKeyboardButton("💬 Chat", callback_data="mode_chat"),
-                InlineKeyboardButton("📈 Finance", callback_data="mode_finance")
-            ],
-            [
-                InlineKeyboardButton("💻 Code", callback_data="mode_code"),
-                InlineKeyboardButton("🌤️ Weather", callback_data="mode_weather"),
-                InlineKeyboardButton("📰 News", callback_data="mode_news")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+        await self._reply(update.message, welcome_message, reply_markup=START_KEYBOARD)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /help command."""
-        help_text = (
-            "🤖 *Open Manus AI Commands*\n\n"
-            "*Basic Commands:*\n"
-            "/start - Start the bot and see main menu\n"
-            "/help - Show this help message\n"
-            "/chat - Enter chat mode\n"
-            "/reset - Reset conversation history\n\n"
-            
-            "*Feature Commands:*\n"
-            "/finance <symbol> - Get financial data for a stock\n"
-            "/code <language> - Generate code (follow with your description)\n"
-            "/weather <location> - Get weather forecast\n"
-            "/news <topic> - Get latest news\n\n"
-            
-            "*Advanced Commands:*\n"
-            "/analyze_code - Analyze code (send code after this command)\n"
-            "/analyze_stock <symbol> - Get detailed stock analysis\n"
-            "/market - Get market overview\n"
-            "/task <description> - Create a task\n\n"
-            
-            "*Settings:*\n"
-            "/settings - View and change settings\n"
-            "/feedback - Send feedback about the bot\n"
-        )
-        
-        await update.message.reply_text(help_text, parse_mode="Markdown")
+        await self._reply(update.message, HELP_TEXT, parse_mode="Markdown")
     
     async def chat_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /chat command."""
-        user_id = str(update.effective_user.id)
+        user_id = self._user_id(update, context)
         self.user_states[user_id] = "chat"
         
-        await update.message.reply_text(
+        await self._reply(
+            update.message,
             "💬 I'm in chat mode now. You can ask me anything or have a conversation. "
             "Your messages will be processed using my AI capabilities."
         )
     
     async def reset_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /reset command."""
-        user_id = str(update.effective_user.id)
+        user_id = self._user_id(update, context)
         
         # Clear conversation history
         self.conversation_module.clear_history(user_id)
         
-        await update.message.reply_text(
+        await self._reply(
+            update.message,
             "🔄 Your conversation history has been reset. We're starting fresh!"
         )
     
     async def finance_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /finance command."""
-        user_id = str(update.effective_user.id)
-        
         # Check if a stock symbol was provided
         if context.args:
             symbol = context.args[0].upper()
             
-            await update.message.reply_text(f"📊 Fetching financial data for {symbol}...")
+            await self._reply(update.message, f"📊 Fetching financial data for {symbol}...")
             
             # Get stock data
-            stock_data = self.financial_analysis.get_stock_data(symbol)
+            stock_data = await asyncio.to_thread(self.financial_analysis.get_stock_data, symbol)
             
             if stock_data.get('success', False):
                 # Format the response
@@ -178,17 +551,17 @@ class TelegramBot:
                 sector = stock_data.get('sector', 'Unknown')
                 market_cap = stock_data.get('market_cap', 'Unknown')
                 
-                # Get the latest price and change
+                # Get the latest price and change (None when no history was returned)
                 stats = stock_data.get('stats', {})
-                latest_price = stats.get('latest_price', 0)
-                price_change = stats.get('price_change', 0)
-                price_change_pct = stats.get('price_change_pct', 0)
+                latest_price = stats.get('latest_price')
+                price_change = stats.get('price_change')
+                price_change_pct = stats.get('price_change_pct')
                 
                 # Create the response message
                 response = (
                     f"📈 *{company_name} ({symbol})*\n\n"
-                    f"*Price:* ${latest_price:.2f}\n"
-                    f"*Change:* {price_change:.2f} ({price_change_pct:.2f}%)\n"
+                    f"*Price:* {_fmt_money(latest_price)}\n"
+                    f"*Change:* {_fmt_number(price_change)} ({_fmt_pct(price_change_pct)})\n"
                     f"*Sector:* {sector}\n"
                     f"*Market Cap:* {market_cap}\n\n"
                 )
@@ -202,35 +575,22 @@ class TelegramBot:
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                await update.message.reply_text(response, reply_markup=reply_markup, parse_mode="Markdown")
+                await self._reply(update.message, response, reply_markup=reply_markup, parse_mode="Markdown")
             else:
-                await update.message.reply_text(
+                await self._reply(
+                    update.message,
                     f"❌ Error retrieving data for {symbol}: {stock_data.get('error', 'Unknown error')}"
                 )
         else:
             # No symbol provided, show instructions
-            await update.message.reply_text(
-                "📈 *Financial Analysis*\n\n"
-                "Please provide a stock symbol to get financial data.\n"
-                "Example: `/finance AAPL`\n\n"
-                "Or use one of these options:",
-                parse_mode="Markdown"
-            )
+            await self._reply(update.message, FINANCE_HELP_TEXT, parse_mode="Markdown")
             
             # Show buttons for common actions
-            keyboard = [
-                [
-                    InlineKeyboardButton("Market Overview", callback_data="market_overview"),
-                    InlineKeyboardButton("Top Stocks", callback_data="top_stocks")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text("Choose an option:", reply_markup=reply_markup)
+            await self._reply(update.message, "Choose an option:", reply_markup=FINANCE_OPTIONS_KEYBOARD)
     
     async def code_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /code command."""
-        user_id = str(update.effective_user.id)
+        user_id = self._user_id(update, context)
         
         # Check if language was provided
         if context.args:
@@ -241,7 +601,8 @@ class TelegramBot:
             # If no prompt in command, set state to wait for prompt
             if not prompt:
                 self.user_states[user_id] = f"code_{language}"
-                await update.message.reply_text(
+                await self._reply(
+                    update.message,
                     f"💻 I'll generate {language} code for you. Please describe what you want me to create."
                 )
                 return
@@ -249,76 +610,51 @@ class TelegramBot:
             # Generate code
             await self._generate_code(update, language, prompt)
         else:
-            # No language provided, show options
-            keyboard = [
-                [
-                    InlineKeyboardButton("Python", callback_data="code_python"),
-                    InlineKeyboardButton("JavaScript", callback_data="code_javascript"),
-                    InlineKeyboardButton("Java", callback_data="code_java")
-                ],
-                [
-                    InlineKeyboardButton("C++", callback_data="code_cpp"),
-                    InlineKeyboardButton("HTML/CSS", callback_data="code_html"),
-                    InlineKeyboardButton("SQL", callback_data="code_sql")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
+            # No language provided, show options (also reached from the mode_code button)
+            await self._reply(
+                update.effective_message,
                 "💻 *Code Generation*\n\n"
                 "Please select a programming language:",
-                reply_markup=reply_markup,
+                reply_markup=CODE_LANGUAGE_KEYBOARD,
                 parse_mode="Markdown"
             )
     
     async def _generate_code(self, update, language, prompt):
         """Generate code based on prompt and language."""
-        await update.message.reply_text(f"💻 Generating {language} code for: {prompt}")
+        await self._reply(update.message, f"💻 Generating {language} code for: {prompt}")
         
         # Generate code
-        result = self.coding_support.generate_code(prompt, language)
+        result = await self._run_ai(self.coding_support.generate_code, prompt, language)
         
         if result.get('success', False):
             code = result.get('code', '')
             
             # Send code with proper formatting
-            await update.message.reply_text(f"```{language}\n{code}\n```", parse_mode="Markdown")
+            await self._reply(update.message, f"```{language}\n{code}\n```", parse_mode="Markdown")
             
             # Send explanation if it's not too long
             explanation = result.get('explanation', '')
             if len(explanation) > 4000:
                 explanation = explanation[:4000] + "...\n\n(Explanation truncated due to length)"
             
-            await update.message.reply_text(explanation)
+            await self._reply(update.message, explanation)
         else:
-            await update.message.reply_text(
+            await self._reply(
+                update.message,
                 f"❌ Error generating code: {result.get('explanation', 'Unknown error')}"
             )
     
     async def analyze_code_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /analyze_code command."""
-        user_id = str(update.effective_user.id)
+        user_id = self._user_id(update, context)
         self.user_states[user_id] = "analyze_code"
         
         # Ask for the code and language
-        keyboard = [
-            [
-                InlineKeyboardButton("Python", callback_data="analyze_python"),
-                InlineKeyboardButton("JavaScript", callback_data="analyze_javascript"),
-                InlineKeyboardButton("Java", callback_data="analyze_java")
-            ],
-            [
-                InlineKeyboardButton("C++", callback_data="analyze_cpp"),
-                InlineKeyboardButton("HTML/CSS", callback_data="analyze_html"),
-                InlineKeyboardButton("SQL", callback_data="analyze_sql")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
+        await self._reply(
+            update.message,
             "💻 *Code Analysis*\n\n"
             "Please select the programming language of the code you want to analyze:",
-            reply_markup=reply_markup,
+            reply_markup=ANALYZE_LANGUAGE_KEYBOARD,
             parse_mode="Markdown"
         )
     
@@ -329,19 +665,20 @@ class TelegramBot:
             location = " ".join(context.args)
             await self._get_weather(update, location)
         else:
-            user_id = str(update.effective_user.id)
+            user_id = self._user_id(update, context)
             self.user_states[user_id] = "weather"
             
-            await update.message.reply_text(
+            await self._reply(
+                update.message,
                 "🌤️ Please provide a location (city name or coordinates) to get the weather forecast."
             )
     
     async def _get_weather(self, update, location):
         """Get weather for a location."""
-        await update.message.reply_text(f"🌤️ Fetching weather for {location}...")
+        await self._reply(update.message, f"🌤️ Fetching weather for {location}...")
         
         # Get current weather
-        weather_data = self.weather_api.get_current_weather(location)
+        weather_data = await asyncio.to_thread(self.weather_api.get_current_weather, location)
         
         if weather_data.get('success', False):
             data = weather_data.get('weather_data', {})
@@ -381,9 +718,10 @@ class TelegramBot:
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(response, reply_markup=reply_markup, parse_mode="Markdown")
+            await self._reply(update.message, response, reply_markup=reply_markup, parse_mode="Markdown")
         else:
-            await update.message.reply_text(
+            await self._reply(
+                update.message,
                 f"❌ Error getting weather for {location}: {weather_data.get('error', 'Unknown error')}"
             )
     
@@ -394,43 +732,35 @@ class TelegramBot:
             query = " ".join(context.args)
             await self._get_news(update, query)
         else:
-            # Show news categories
-            keyboard = [
-                [
-                    InlineKeyboardButton("Top Headlines", callback_data="news_headlines"),
-                    InlineKeyboardButton("Business", callback_data="news_business")
-                ],
-                [
-                    InlineKeyboardButton("Technology", callback_data="news_technology"),
-                    InlineKeyboardButton("Science", callback_data="news_science")
-                ],
-                [
-                    InlineKeyboardButton("Health", callback_data="news_health"),
-                    InlineKeyboardButton("Sports", callback_data="news_sports")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
+            # Show news categories (also reached from the mode_news button)
+            await self._reply(
+                update.effective_message,
                 "📰 *News*\n\n"
                 "Please select a news category or use `/news <topic>` to search for specific news.",
-                reply_markup=reply_markup,
+                reply_markup=NEWS_CATEGORY_KEYBOARD,
                 parse_mode="Markdown"
             )
     
     async def _get_news(self, update, query):
         """Get news for a topic."""
-        await update.message.reply_text(f"📰 Searching news about: {query}")
+        await self._reply(update.message, f"📰 Searching news about: {query}")
         
         # Search news
-        news_data = self.news_api.search_news(query=query, page_size=5)
+        news_data = await asyncio.to_thread(self.news_api.search_news, query=query, page_size=5)
         
         if news_data.get('success', False):
             articles = news_data.get('articles', [])
             
             if articles:
+                # Button to summarize, attached to the last article rather than sent separately
+                keyboard = [
+                    [InlineKeyboardButton("Summarize Articles", callback_data=f"summarize_{query}")]
+                ]
+                summarize_markup = InlineKeyboardMarkup(keyboard)
+                
                 # Send each article
-                for i, article in enumerate(articles[:5]):
+                shown = articles[:5]
+                for i, article in enumerate(shown):
                     title = article.get('title', '')
                     source = article.get('source', {}).get('name', '')
                     description = article.get('description', '')
@@ -443,35 +773,22 @@ class TelegramBot:
                         f"[Read more]({url})"
                     )
                     
-                    await update.message.reply_text(response, parse_mode="Markdown")
-                    
-                    # Add a small delay between messages
-                    if i < len(articles) - 1:
-                        await asyncio.sleep(0.5)
-                
-                # Add button to summarize
-                keyboard = [
-                    [InlineKeyboardButton("Summarize Articles", callback_data=f"summarize_{query}")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(
-                    "Would you like me to summarize these articles?",
-                    reply_markup=reply_markup
-                )
+                    reply_markup = summarize_markup if i == len(shown) - 1 else None
+                    await self._reply(update.message, response, parse_mode="Markdown", reply_markup=reply_markup)
             else:
-                await update.message.reply_text(f"No news found for: {query}")
+                await self._reply(update.message, f"No news found for: {query}")
         else:
-            await update.message.reply_text(
+            await self._reply(
+                update.message,
                 f"❌ Error searching news: {news_data.get('error', 'Unknown error')}"
             )
     
     async def settings_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /settings command."""
-        user_id = str(update.effective_user.id)
+        user_id = self._user_id(update, context)
         
         # Get user preferences
-        preferences = self.memory_manager.get_memory(user_id, "preferences", {})
+        preferences = await asyncio.to_thread(self.memory_manager.get_memory, user_id, "preferences", {})
         
         # Format current settings
         settings_text = (
@@ -481,27 +798,15 @@ class TelegramBot:
             f"*News Country:* {preferences.get('news_country', 'US')}\n"
         )
         
-        # Create settings buttons
-        keyboard = [
-            [
-                InlineKeyboardButton("Change Language", callback_data="settings_language"),
-                InlineKeyboardButton("Change Units", callback_data="settings_units")
-            ],
-            [
-                InlineKeyboardButton("Change News Country", callback_data="settings_news_country"),
-                InlineKeyboardButton("Reset All Settings", callback_data="settings_reset")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(settings_text, reply_markup=reply_markup, parse_mode="Markdown")
+        await self._reply(update.message, settings_text, reply_markup=SETTINGS_KEYBOARD, parse_mode="Markdown")
     
     async def feedback_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /feedback command."""
-        user_id = str(update.effective_user.id)
+        user_id = self._user_id(update, context)
         self.user_states[user_id] = "feedback"
         
-        await update.message.reply_text(
+        await self._reply(
+            update.message,
             "📝 I'd love to hear your feedback! Please share your thoughts, suggestions, or report any issues."
         )
     
@@ -510,7 +815,7 @@ class TelegramBot:
         if not update.message or not update.message.text:
             return
         
-        user_id = str(update.effective_user.id)
+        user_id = self._user_id(update, context)
         message_text = update.message.text
         
         # Check user state
@@ -518,24 +823,27 @@ class TelegramBot:
         
         if state.startswith("code_"):
             # Generate code in the specified language
-            language = state.split("_")[1]
+            language = state.partition("_")[2]
+            self._show_typing(context, update.effective_chat)
             await self._generate_code(update, language, message_text)
             self.user_states[user_id] = "chat"  # Reset state
         
         elif state == "analyze_code":
             # User needs to select language first
-            await update.message.reply_text(
+            await self._reply(
+                update.message,
                 "Please select the programming language using the buttons above."
             )
         
         elif state.startswith("analyze_"):
             # Analyze code in the specified language
-            language = state.split("_")[1]
+            language = state.partition("_")[2]
+            self._show_typing(context, update.effective_chat)
             
-            await update.message.reply_text(f"💻 Analyzing {language} code...")
+            await self._reply(update.message, f"💻 Analyzing {language} code...")
             
             # Analyze code
-            result = self.coding_support.analyze_code(message_text, language)
+            result = await self._run_ai(self.coding_support.analyze_code, message_text, language)
             
             if result.get('success', False):
                 analysis = result.get('analysis', '')
@@ -544,11 +852,12 @@ class TelegramBot:
                 if len(analysis) > 4000:
                     chunks = [analysis[i:i+4000] for i in range(0, len(analysis), 4000)]
                     for chunk in chunks:
-                        await update.message.reply_text(chunk)
+                        await self._reply(update.message, chunk)
                 else:
-                    await update.message.reply_text(analysis)
+                    await self._reply(update.message, analysis)
             else:
-                await update.message.reply_text(
+                await self._reply(
+                    update.message,
                     f"❌ Error analyzing code: {result.get('analysis', 'Unknown error')}"
                 )
             
@@ -561,9 +870,10 @@ class TelegramBot:
         
         elif state == "feedback":
             # Save feedback
-            self.memory_manager.save_memory(user_id, "feedback", message_text)
+            await asyncio.to_thread(self.memory_manager.save_memory, user_id, "feedback", message_text)
             
-            await update.message.reply_text(
+            await self._reply(
+                update.message,
                 "🙏 Thank you for your feedback! We appreciate your input and will use it to improve Open Manus AI."
             )
             
@@ -571,443 +881,502 @@ class TelegramBot:
         
         else:  # Default to chat mode
             # Get response from conversation module
-            with update.message.chat.action("typing"):
-                response = self.conversation_module.get_response(user_id, message_text)
+            self._show_typing(context, update.effective_chat)
+            response = await self._run_ai(self.conversation_module.get_response, user_id, message_text)
             
-            await update.message.reply_text(response)
+            await self._reply(update.message, response)
     
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle callback queries from inline keyboards."""
         query = update.callback_query
-        user_id = str(query.from_user.id)
+        user_id = self._user_id(update, context)
         data = query.data
         
         # Acknowledge the callback
         await query.answer()
         
-        # Handle different callback types
-        if data.startswith("mode_"):
-            # Mode selection
-            mode = data.split("_")[1]
-            
-            if mode == "chat":
-                self.user_states[user_id] = "chat"
-                await query.message.reply_text("💬 I'm in chat mode. How can I help you today?")
-            
-            elif mode == "finance":
-                await query.message.reply_text(
-                    "📈 *Financial Analysis*\n\n"
-                    "Please use `/finance <symbol>` to get data for a specific stock.\n"
-                    "Example: `/finance AAPL`",
-                    parse_mode="Markdown"
-                )
-            
-            elif mode == "code":
-                await self.code_command(update, context)
-            
-            elif mode == "weather":
-                await query.message.reply_text(
-                    "🌤️ *Weather*\n\n"
-                    "Please use `/weather <location>` to get the forecast.\n"
-                    "Example: `/weather New York`",
-                    parse_mode="Markdown"
-                )
-            
-            elif mode == "news":
-                await self.news_command(update, context)
+        # Fixed buttons are a single dict lookup
+        handler = self._exact_callback_handlers.get(data)
+        if handler is not None:
+            await handler(update, context, user_id, "")
+            return
         
-        elif data.startswith("code_"):
-            # Code language selection
-            language = data.split("_")[1]
-            self.user_states[user_id] = f"code_{language}"
-            
-            await query.message.reply_text(
-                f"💻 I'll generate {language} code for you. Please describe what you want me to create."
+        # Otherwise dispatch on the callback prefix; the argument is everything after it
+        match = CALLBACK_PATTERN.match(data)
+        if match is None:
+            logger.warning(f"Unhandled callback data: {data}")
+            return
+        
+        prefix, arg = match.groups()
+        await self._callback_handlers[prefix](update, context, user_id, arg or "")
+    
+    async def _cb_mode(self, update, context, user_id, arg):
+        """Handle main menu mode selection."""
+        query = update.callback_query
+        
+        # Mode selection
+        mode = arg
+        
+        if mode == "chat":
+            self.user_states[user_id] = "chat"
+            await self._reply(query.message, "💬 I'm in chat mode. How can I help you today?")
+        
+        elif mode == "finance":
+            await self._reply(
+                query.message,
+                "📈 *Financial Analysis*\n\n"
+                "Please use `/finance <symbol>` to get data for a specific stock.\n"
+                "Example: `/finance AAPL`",
+                parse_mode="Markdown"
             )
         
-        elif data.startswith("analyze_"):
-            # Code analysis language selection
-            language = data.split("_")[1]
-            self.user_states[user_id] = f"analyze_{language}"
-            
-            await query.message.reply_text(
-                f"💻 Please send me the {language} code you want to analyze."
+        elif mode == "code":
+            await self.code_command(update, context)
+        
+        elif mode == "weather":
+            await self._reply(
+                query.message,
+                "🌤️ *Weather*\n\n"
+                "Please use `/weather <location>` to get the forecast.\n"
+                "Example: `/weather New York`",
+                parse_mode="Markdown"
             )
         
-        elif data.startswith("analyze_stock_"):
-            # Stock analysis
-            symbol = data.split("_")[2]
+        elif mode == "news":
+            await self.news_command(update, context)
+    
+    async def _cb_code_language(self, update, context, user_id, arg):
+        """Handle code generation language selection."""
+        query = update.callback_query
+        
+        # Code language selection
+        language = arg
+        self.user_states[user_id] = f"code_{language}"
+        
+        await self._reply(
+            query.message,
+            f"💻 I'll generate {language} code for you. Please describe what you want me to create."
+        )
+    
+    async def _cb_analyze_language(self, update, context, user_id, arg):
+        """Handle code analysis language selection."""
+        query = update.callback_query
+        
+        # Code analysis language selection
+        language = arg
+        self.user_states[user_id] = f"analyze_{language}"
+        
+        await self._reply(
+            query.message,
+            f"💻 Please send me the {language} code you want to analyze."
+        )
+    
+    async def _cb_analyze_stock(self, update, context, user_id, arg):
+        """Handle a stock analysis request."""
+        query = update.callback_query
+        
+        # Stock analysis
+        symbol = arg
+        
+        await self._reply(query.message, f"📊 Analyzing {symbol}...")
+        
+        # Get stock analysis
+        analysis = await asyncio.to_thread(self.financial_analysis.analyze_stock, symbol)
+        
+        if analysis.get('success', False):
+            # Format the response
+            company_info = analysis.get('company_info', {})
+            company_name = company_info.get('company_name', symbol)
             
-            await query.message.reply_text(f"📊 Analyzing {symbol}...")
+            # Technical indicators
+            indicators = analysis.get('technical_indicators', {})
             
-            # Get stock analysis
-            analysis = self.financial_analysis.analyze_stock(symbol)
+            # Create response
+            parts = [
+                f"📊 *Analysis for {company_name} ({symbol})*\n\n"
+                f"*Price:* {_fmt_money(indicators.get('price'))}\n"
+                f"*RSI:* {_fmt_number(indicators.get('rsi'))}\n"
+                f"*MACD:* {_fmt_number(indicators.get('macd'))}\n\n"
+                "*Signals:*\n"
+            ]
             
-            if analysis.get('success', False):
-                # Format the response
-                company_info = analysis.get('company_info', {})
-                company_name = company_info.get('company_name', symbol)
+            # Add signals
+            if indicators.get('above_ma20', False):
+                parts.append("✅ Price above 20-day moving average\n")
+            else:
+                parts.append("❌ Price below 20-day moving average\n")
+                
+            if indicators.get('above_ma50', False):
+                parts.append("✅ Price above 50-day moving average\n")
+            else:
+                parts.append("❌ Price below 50-day moving average\n")
                 
-                # Technical indicators
-                indicators = analysis.get('technical_indicators', {})
+            if indicators.get('rsi_oversold', False):
+                parts.append("⚠️ RSI indicates oversold conditions\n")
+            elif indicators.get('rsi_overbought', False):
+                parts.append("⚠️ RSI indicates overbought conditions\n")
+            else:
+                parts.append("✅ RSI in neutral range\n")
                 
+            if indicators.get('macd_bullish', False):
+                parts.append("✅ MACD indicates bullish trend\n")
+            else:
+                parts.append("❌ MACD indicates bearish trend\n")
+            
+            await self._reply(query.message, "".join(parts), parse_mode="Markdown")
+        else:
+            await self._reply(
+                query.message,
+                f"❌ Error analyzing {symbol}: {analysis.get('error', 'Unknown error')}"
+            )
+    
+    async def _cb_market_overview(self, update, context, user_id, arg):
+        """Handle a market overview request."""
+        query = update.callback_query
+        
+        # Market overview
+        await self._reply(query.message, "📊 Fetching market overview...")
+        
+        # Get market data
+        market_data = await asyncio.to_thread(self.financial_analysis.get_market_overview)
+        
+        if market_data.get('success', False):
+            market_indices = market_data.get('data', {})
+            
+            if market_indices:
                 # Create response
-                response = (
-                    f"📊 *Analysis for {company_name} ({symbol})*\n\n"
-                    f"*Price:* ${indicators.get('price', 0):.2f}\n"
-                    f"*RSI:* {indicators.get('rsi', 0):.2f}\n"
-                    f"*MACD:* {indicators.get('macd', 0):.2f}\n\n"
-                    "*Signals:*\n"
-                )
+                parts = ["📊 *Market Overview*\n\n"]
                 
-                # Add signals
-                if indicators.get('above_ma20', False):
-                    response += "✅ Price above 20-day moving average\n"
-                else:
-                    response += "❌ Price below 20-day moving average\n"
+                for symbol, data in market_indices.items():
+                    name = data.get('name', symbol)
                     
-                if indicators.get('above_ma50', False):
-                    response += "✅ Price above 50-day moving average\n"
-                else:
-                    response += "❌ Price below 50-day moving average\n"
+                    # Add emoji based on change (values are None when an index returned no history)
+                    emoji = _sign_emoji(data.get('change'))
                     
-                if indicators.get('rsi_oversold', False):
-                    response += "⚠️ RSI indicates oversold conditions\n"
-                elif indicators.get('rsi_overbought', False):
-                    response += "⚠️ RSI indicates overbought conditions\n"
-                else:
-                    response += "✅ RSI in neutral range\n"
-                    
-                if indicators.get('macd_bullish', False):
-                    response += "✅ MACD indicates bullish trend\n"
-                else:
-                    response += "❌ MACD indicates bearish trend\n"
+                    parts.append(
+                        f"{emoji} *{name}*: {_fmt_money(data.get('latest_price'))} ({_fmt_pct(data.get('change_pct'))})\n"
+                    )
                 
-                await query.message.reply_text(response, parse_mode="Markdown")
+                await self._reply(query.message, "".join(parts), parse_mode="Markdown")
             else:
-                await query.message.reply_text(
-                    f"❌ Error analyzing {symbol}: {analysis.get('error', 'Unknown error')}"
-                )
+                await self._reply(query.message, "No market data available.")
+        else:
+            await self._reply(
+                query.message,
+                f"❌ Error getting market overview: {market_data.get('error', 'Unknown error')}"
+            )
+    
+    async def _cb_forecast(self, update, context, user_id, arg):
+        """Handle a weather forecast request."""
+        query = update.callback_query
         
-        elif data == "market_overview":
-            # Market overview
-            await query.message.reply_text("📊 Fetching market overview...")
-            
-            # Get market data
-            market_data = self.financial_analysis.get_market_overview()
+        # Weather forecast
+        location = arg
+        
+        await self._reply(query.message, f"🌤️ Fetching forecast for {location}...")
+        
+        # Get forecast
+        forecast = await asyncio.to_thread(self.weather_api.get_weather_forecast, location)
+        
+        if forecast.get('success', False):
+            forecast_data = forecast.get('forecast_data', {})
+            forecast_days = forecast_data.get('forecast', {})
             
-            if market_data.get('success', False):
-                market_indices = market_data.get('data', {})
+            if forecast_days:
+                # Create response
+                parts = [f"🌤️ *5-Day Forecast for {location}*\n\n"]
+                units = forecast_data.get('units', 'metric')
+                temp_unit = "°C" if units == "metric" else "°F"
                 
-                if market_indices:
-                    # Create response
-                    response = "📊 *Market Overview*\n\n"
+                for date, day_data in list(forecast_days.items())[:5]:
+                    # Format date
+                    date_obj = datetime.strptime(date, "%Y-%m-%d")
+                    day_str = date_obj.strftime("%a, %b %d")
+                    
+                    # Get mid-day forecast
+                    mid_day = None
+                    for item in day_data:
+                        item_time = datetime.fromisoformat(item['datetime'])
+                        if 11 <= item_time.hour <= 14:
+                            mid_day = item
+                            break
                     
-                    for symbol, data in market_indices.items():
-                        name = data.get('name', symbol)
-                        price = data.get('latest_price', 0)
-                        change = data.get('change', 0)
-                        change_pct = data.get('change_pct', 0)
+                    if not mid_day and day_data:
+                        mid_day = day_data[len(day_data)//2]
+                    
+                    if mid_day:
+                        # Get weather info
+                        temp = mid_day.get('temperature', {}).get('current', 0)
+                        condition = mid_day.get('weather', {}).get('condition', '')
+                        pop = mid_day.get('precipitation', {}).get('probability', 0) * 100
                         
-                        # Add emoji based on change
-                        emoji = "🟢" if change >= 0 else "🔴"
+                        # Add emoji based on condition (first matching keyword wins)
+                        condition_lower = condition.lower()
+                        emoji = next(
+                            (icon for keyword, icon in CONDITION_EMOJI if keyword in condition_lower),
+                            "☀️"
+                        )
                         
-                        response += f"{emoji} *{name}*: ${price:.2f} ({change_pct:.2f}%)\n"
-                    
-                    await query.message.reply_text(response, parse_mode="Markdown")
-                else:
-                    await query.message.reply_text("No market data available.")
+                        # Add to response
+                        parts.append(f"{emoji} *{day_str}*: {temp}{temp_unit}, {condition}, Rain: {pop:.0f}%\n\n")
+                
+                await self._reply(query.message, "".join(parts), parse_mode="Markdown")
             else:
-                await query.message.reply_text(
-                    f"❌ Error getting market overview: {market_data.get('error', 'Unknown error')}"
-                )
+                await self._reply(query.message, "No forecast data available.")
+        else:
+            await self._reply(
+                query.message,
+                f"❌ Error getting forecast: {forecast.get('error', 'Unknown error')}"
+            )
+    
+    async def _cb_news(self, update, context, user_id, arg):
+        """Handle news category selection."""
+        query = update.callback_query
         
-        elif data.startswith("forecast_"):
-            # Weather forecast
-            location = data.split("_", 1)[1]
-            
-            await query.message.reply_text(f"🌤️ Fetching forecast for {location}...")
+        # News category
+        category = arg
+        
+        if category == "headlines":
+            # Get top headlines
+            await self._reply(query.message, "📰 Fetching top headlines...")
             
-            # Get forecast
-            forecast = self.weather_api.get_weather_forecast(location)
+            headlines = await asyncio.to_thread(self.news_api.get_top_headlines, page_size=5)
             
-            if forecast.get('success', False):
-                forecast_data = forecast.get('forecast_data', {})
-                forecast_days = forecast_data.get('forecast', {})
+            if headlines.get('success', False):
+                articles = headlines.get('headlines', [])
                 
-                if forecast_days:
-                    # Create response
-                    response = f"🌤️ *5-Day Forecast for {location}*\n\n"
-                    
-                    for date, day_data in list(forecast_days.items())[:5]:
-                        # Format date
-                        date_obj = datetime.strptime(date, "%Y-%m-%d")
-                        day_str = date_obj.strftime("%a, %b %d")
-                        
-                        # Get mid-day forecast
-                        mid_day = None
-                        for item in day_data:
-                            item_time = datetime.fromisoformat(item['datetime'])
-                            if 11 <= item_time.hour <= 14:
-                                mid_day = item
-                                break
+                if articles:
+                    for article in articles[:5]:
+                        title = article.get('title', '')
+                        source = article.get('source', {}).get('name', '')
+                        description = article.get('description', '')
+                        url = article.get('url', '')
                         
-                        if not mid_day and day_data:
-                            mid_day = day_data[len(day_data)//2]
+                        response = (
+                            f"📰 *{title}*\n"
+                            f"Source: {source}\n\n"
+                            f"{description}\n\n"
+                            f"[Read more]({url})"
+                        )
                         
-                        if mid_day:
-                            # Get weather info
-                            temp = mid_day.get('temperature', {}).get('current', 0)
-                            condition = mid_day.get('weather', {}).get('condition', '')
-                            pop = mid_day.get('precipitation', {}).get('probability', 0) * 100
-                            
-                            # Add emoji based on condition
-                            emoji = "☀️"
-                            if "rain" in condition.lower():
-                                emoji = "🌧️"
-                            elif "cloud" in condition.lower():
-                                emoji = "☁️"
-                            elif "snow" in condition.lower():
-                                emoji = "❄️"
-                            elif "storm" in condition.lower() or "thunder" in condition.lower():
-                                emoji = "⛈️"
-                            
-                            # Add to response
-                            units = forecast_data.get('units', 'metric')
-                            temp_unit = "°C" if units == "metric" else "°F"
-                            
-                            response += f"{emoji} *{day_str}*: {temp}{temp_unit}, {condition}, Rain: {pop:.0f}%\n\n"
-                    
-                    await query.message.reply_text(response, parse_mode="Markdown")
+                        await self._reply(query.message, response, parse_mode="Markdown")
                 else:
-                    await query.message.reply_text("No forecast data available.")
+                    await self._reply(query.message, "No headlines found.")
             else:
-                await query.message.reply_text(
-                    f"❌ Error getting forecast: {forecast.get('error', 'Unknown error')}"
+                await self._reply(
+                    query.message,
+                    f"❌ Error getting headlines: {headlines.get('error', 'Unknown error')}"
                 )
-        
-        elif data.startswith("news_"):
-            # News category
-            category = data.split("_")[1]
-            
-            if category == "headlines":
-                # Get top headlines
-                await query.message.reply_text("📰 Fetching top headlines...")
-                
-                headlines = self.news_api.get_top_headlines(page_size=5)
-                
-                if headlines.get('success', False):
-                    articles = headlines.get('headlines', [])
-                    
-                    if articles:
-                        for article in articles[:5]:
-                            title = article.get('title', '')
-                            source = article.get('source', {}).get('name', '')
-                            description = article.get('description', '')
-                            url = article.get('url', '')
-                            
-                            response = (
-                                f"📰 *{title}*\n"
-                                f"Source: {source}\n\n"
-                                f"{description}\n\n"
-                                f"[Read more]({url})"
-                            )
-                            
-                            await query.message.reply_text(response, parse_mode="Markdown")
-                            await asyncio.sleep(0.5)
-                    else:
-                        await query.message.reply_text("No headlines found.")
-                else:
-                    await query.message.reply_text(
-                        f"❌ Error getting headlines: {headlines.get('error', 'Unknown error')}"
-                    )
-            else:
-                # Get category news
-                await query.message.reply_text(f"📰 Fetching {category} news...")
-                
-                headlines = self.news_api.get_top_headlines(category=category, page_size=5)
-                
-                if headlines.get('success', False):
-                    articles = headlines.get('headlines', [])
-                    
-                    if articles:
-                        for article in articles[:5]:
-                            title = article.get('title', '')
-                            source = article.get('source', {}).get('name', '')
-                            description = article.get('description', '')
-                            url = article.get('url', '')
-                            
-                            response = (
-                                f"📰 *{title}*\n"
-                                f"Source: {source}\n\n"
-                                f"{description}\n\n"
-                                f"[Read more]({url})"
-                            )
-                            
-                            await query.message.reply_text(response, parse_mode="Markdown")
-                            await asyncio.sleep(0.5)
-                    else:
-                        await query.message.reply_text(f"No {category} news found.")
-                else:
-                    await query.message.reply_text(
-                        f"❌ Error getting {category} news: {headlines.get('error', 'Unknown error')}"
-                    )
-        
-        elif data.startswith("summarize_"):
-            # Summarize news
-            query_text = data.split("_", 1)[1]
-            
-            await query.message.reply_text(f"📰 Summarizing news about: {query_text}")
+        else:
+            # Get category news
+            await self._reply(query.message, f"📰 Fetching {category} news...")
             
-            # Get news articles
-            news_data = self.news_api.search_news(query=query_text, page_size=5)
+            headlines = await asyncio.to_thread(self.news_api.get_top_headlines, category=category, page_size=5)
             
-            if news_data.get('success', False):
-                articles = news_data.get('articles', [])
+            if headlines.get('success', False):
+                articles = headlines.get('headlines', [])
                 
                 if articles:
-                    # Summarize articles
-                    summary = self.news_api.summarize_news(articles, self.ai_engine)
-                    
-                    if summary.get('success', False):
-                        await query.message.reply_text(
-                            f"📰 *News Summary: {query_text}*\n\n{summary.get('summary', '')}",
-                            parse_mode="Markdown"
-                        )
-                    else:
-                        await query.message.reply_text(
-                            f"❌ Error summarizing news: {summary.get('error', 'Unknown error')}"
+                    for article in articles[:5]:
+                        title = article.get('title', '')
+                        source = article.get('source', {}).get('name', '')
+                        description = article.get('description', '')
+                        url = article.get('url', '')
+                        
+                        response = (
+                            f"📰 *{title}*\n"
+                            f"Source: {source}\n\n"
+                            f"{description}\n\n"
+                            f"[Read more]({url})"
                         )
+                        
+                        await self._reply(query.message, response, parse_mode="Markdown")
                 else:
-                    await query.message.reply_text(f"No news found for: {query_text}")
+                    await self._reply(query.message, f"No {category} news found.")
             else:
-                await query.message.reply_text(
-                    f"❌ Error getting news: {news_data.get('error', 'Unknown error')}"
+                await self._reply(
+                    query.message,
+                    f"❌ Error getting {category} news: {headlines.get('error', 'Unknown error')}"
                 )
+    
+    async def _cb_summarize(self, update, context, user_id, arg):
+        """Handle a news summary request."""
+        query = update.callback_query
         
-        elif data.startswith("settings_"):
-            # Settings options
-            setting = data.split("_")[1]
-            
-            if setting == "language":
-                # Language options
-                keyboard = [
-                    [
-                        InlineKeyboardButton("English", callback_data="set_language_english"),
-                        InlineKeyboardButton("Spanish", callback_data="set_language_spanish")
-                    ],
-                    [
-                        InlineKeyboardButton("French", callback_data="set_language_french"),
-                        InlineKeyboardButton("German", callback_data="set_language_german")
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.message.reply_text(
-                    "Select your preferred language:",
-                    reply_markup=reply_markup
-                )
-            
-            elif setting == "units":
-                # Units options
-                keyboard = [
-                    [
-                        InlineKeyboardButton("Metric (°C, m/s)", callback_data="set_units_metric"),
-                        InlineKeyboardButton("Imperial (°F, mph)", callback_data="set_units_imperial")
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.message.reply_text(
-                    "Select your preferred units:",
-                    reply_markup=reply_markup
-                )
-            
-            elif setting == "news_country":
-                # News country options
-                keyboard = [
-                    [
-                        InlineKeyboardButton("US", callback_data="set_news_country_us"),
-                        InlineKeyboardButton("UK", callback_data="set_news_country_gb"),
-                        InlineKeyboardButton("Canada", callback_data="set_news_country_ca")
-                    ],
-                    [
-                        InlineKeyboardButton("Australia", callback_data="set_news_country_au"),
-                        InlineKeyboardButton("India", callback_data="set_news_country_in"),
-                        InlineKeyboardButton("Germany", callback_data="set_news_country_de")
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.message.reply_text(
-                    "Select your preferred news country:",
-                    reply_markup=reply_markup
-                )
+        # Summarize news
+        query_text = arg
+        
+        await self._reply(query.message, f"📰 Summarizing news about: {query_text}")
+        
+        # Get news articles
+        news_data = await asyncio.to_thread(self.news_api.search_news, query=query_text, page_size=5)
+        
+        if news_data.get('success', False):
+            articles = news_data.get('articles', [])
             
-            elif setting == "reset":
-                # Reset all settings
-                self.memory_manager.save_memory(user_id, "preferences", {})
+            if articles:
+                # Summarize articles
+                summary = await self._run_ai(self.news_api.summarize_news, articles, self.ai_engine)
                 
-                await query.message.reply_text(
-                    "✅ All settings have been reset to default values."
-                )
+                if summary.get('success', False):
+                    await self._reply(
+                        query.message,
+                        f"📰 *News Summary: {query_text}*\n\n{summary.get('summary', '')}",
+                        parse_mode="Markdown"
+                    )
+                else:
+                    await self._reply(
+                        query.message,
+                        f"❌ Error summarizing news: {summary.get('error', 'Unknown error')}"
+                    )
+            else:
+                await self._reply(query.message, f"No news found for: {query_text}")
+        else:
+            await self._reply(
+                query.message,
+                f"❌ Error getting news: {news_data.get('error', 'Unknown error')}"
+            )
+    
+    async def _cb_settings(self, update, context, user_id, arg):
+        """Handle settings menu selection."""
+        query = update.callback_query
         
-        elif data.startswith("set_"):
-            # Set specific setting
-            parts = data.split("_")
-            setting_type = parts[1]
-            setting_value = parts[2]
-            
-            # Get current preferences
-            preferences = self.memory_manager.get_memory(user_id, "preferences", {})
-            
-            # Update preference
-            if setting_type == "language":
-                preferences["language"] = setting_value.capitalize()
-            elif setting_type == "units":
-                preferences["units"] = setting_value.capitalize()
-            elif setting_type == "news_country":
-                preferences["news_country"] = setting_value.upper()
-            
-            # Save updated preferences
-            self.memory_manager.save_memory(user_id, "preferences", preferences)
+        # Settings options
+        setting = arg
+        
+        if setting == "language":
+            # Language options
+            await self._reply(
+                query.message,
+                "Select your preferred language:",
+                reply_markup=LANGUAGE_SETTINGS_KEYBOARD
+            )
+        
+        elif setting == "units":
+            # Units options
+            await self._reply(
+                query.message,
+                "Select your preferred units:",
+                reply_markup=UNITS_SETTINGS_KEYBOARD
+            )
+        
+        elif setting == "news_country":
+            # News country options
+            await self._reply(
+                query.message,
+                "Select your preferred news country:",
+                reply_markup=NEWS_COUNTRY_SETTINGS_KEYBOARD
+            )
+        
+        elif setting == "reset":
+            # Reset all settings
+            await asyncio.to_thread(self.memory_manager.save_memory, user_id, "preferences", {})
             
-            await query.message.reply_text(
-                f"✅ Your {setting_type} preference has been updated to {setting_value.capitalize()}."
+            await self._reply(
+                query.message,
+                "✅ All settings have been reset to default values."
             )
     
+    async def _cb_set(self, update, context, user_id, arg):
+        """Handle a settings value selection."""
+        query = update.callback_query
+        
+        # Set specific setting
+        setting_type, _, setting_value = arg.rpartition("_")
+        
+        # Get current preferences
+        preferences = await asyncio.to_thread(self.memory_manager.get_memory, user_id, "preferences", {})
+        
+        # Update preference
+        if setting_type == "language":
+            preferences["language"] = setting_value.capitalize()
+        elif setting_type == "units":
+            preferences["units"] = setting_value.capitalize()
+        elif setting_type == "news_country":
+            preferences["news_country"] = setting_value.upper()
+        
+        # Save updated preferences
+        await asyncio.to_thread(self.memory_manager.save_memory, user_id, "preferences", preferences)
+        
+        await self._reply(
+            query.message,
+            f"✅ Your {setting_type} preference has been updated to {setting_value.capitalize()}."
+        )
+    
     async def error_handler(self, update, context):
         """Handle errors."""
         logger.error(f"Error: {context.error}")
         
         if update and update.effective_message:
-            await update.effective_message.reply_text(
+            await self._reply(
+                update.effective_message,
                 "❌ An error occurred while processing your request. Please try again later."
             )
     
+    async def _expire_user_states(self):
+        """Periodically drop the states and send limiters of idle users and chats."""
+        while True:
+            await asyncio.sleep(USER_STATE_GC_INTERVAL)
+            self._expire_chat_limiters()
+            expired = self.user_states.expire()
+            if expired:
+                logger.debug(f"Expired {expired} idle user states ({len(self.user_states)} remaining)")
+    
+    def _expire_chat_limiters(self):
+        """Drop the send limiters of chats that have nothing waiting and a full bucket."""
+        idle_chats = [chat_id for chat_id, limiter in self.chat_limiters.items() if limiter.is_idle()]
+        for chat_id in idle_chats:
+            del self.chat_limiters[chat_id]
+    
+    async def _post_init(self, application):
+        """Start background tasks once the application is initialized."""
+        # The application isn't running yet, so schedule on the loop and keep the handle
+        self._expire_task = asyncio.create_task(self._expire_user_states())
+    
+    async def _post_shutdown(self, application):
+        """Stop background tasks when the application shuts down."""
+        if self._expire_task is not None:
+            self._expire_task.cancel()
+            try:
+                await self._expire_task
+            except asyncio.CancelledError:
+                pass
+            self._expire_task = None
+    
     def run(self):
         """Run the bot."""
-        # Create application
-        application = Application.builder().token(self.token).build()
+        # Create application (all API calls share the application's bot and its connection pool)
+        application = (
+            Application.builder()
+            .token(self.token)
+            .connection_pool_size(self.connection_pool_size)
+            .pool_timeout(self.pool_timeout)
+            .connect_timeout(self.connect_timeout)
+            .read_timeout(self.read_timeout)
+            .concurrent_updates(self.concurrent_updates)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         
         # Add handlers
-        application.add_handler(CommandHandler("start", self.start_command))
-        application.add_handler(CommandHandler("help", self.help_command))
-        application.add_handler(CommandHandler("chat", self.chat_command))
-        application.add_handler(CommandHandler("reset", self.reset_command))
-        application.add_handler(CommandHandler("finance", self.finance_command))
-        application.add_handler(CommandHandler("code", self.code_command))
-        application.add_handler(CommandHandler("analyze_code", self.analyze_code_command))
-        application.add_handler(CommandHandler("weather", self.weather_command))
-        application.add_handler(CommandHandler("news", self.news_command))
-        application.add_handler(CommandHandler("settings", self.settings_command))
-        application.add_handler(CommandHandler("feedback", self.feedback_command))
+        application.add_handler(CommandHandler("start", self.start_command, block=False))
+        application.add_handler(CommandHandler("help", self.help_command, block=False))
+        application.add_handler(CommandHandler("chat", self.chat_command, block=False))
+        application.add_handler(CommandHandler("reset", self.reset_command, block=False))
+        application.add_handler(CommandHandler("finance", self.finance_command, block=False))
+        application.add_handler(CommandHandler("code", self.code_command, block=False))
+        application.add_handler(CommandHandler("analyze_code", self.analyze_code_command, block=False))
+        application.add_handler(CommandHandler("weather", self.weather_command, block=False))
+        application.add_handler(CommandHandler("news", self.news_command, block=False))
+        application.add_handler(CommandHandler("settings", self.settings_command, block=False))
+        application.add_handler(CommandHandler("feedback", self.feedback_command, block=False))
         
         # Add message handler
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message, block=False))
         
         # Add callback query handler
-        application.add_handler(CallbackQueryHandler(self.handle_callback))
+        application.add_handler(CallbackQueryHandler(self.handle_callback, block=False))
         
         # Add error handler
         application.add_error_handler(self.error_handler)
@@ -7,13 +7,18 @@ capabilities for the Open Manus AI system.
 
 import logging
 import os
+import re
 import subprocess
 import tempfile
-from pathlib import Path
+
+from src.utils.code_blocks import language_code_block_pattern
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Matches any fenced code block, regardless of language tag
+CODE_BLOCK_PATTERN = re.compile(r"```(.*?)```", re.DOTALL)
+
 class CodingSupportModule:
     """
     Coding Support Module for providing programming assistance.
@@ -90,21 +95,17 @@ class CodingSupportModule:
         Returns:
             str: Extracted code or empty string if no code found
         """
-        import re
-        
         # Look for code blocks with language tag
-        pattern = f"```{language}(.*?)```"
-        matches = re.findall(pattern, response, re.DOTALL)
+        match = language_code_block_pattern(language).search(response)
         
-        if matches:
-            return matches[0].strip()
+        if match:
+            return match.group(1).strip()
         
         # If no language-specific blocks found, try generic code blocks
-        pattern = r"```(.*?)```"
-        matches = re.findall(pattern, response, re.DOTALL)
+        match = CODE_BLOCK_PATTERN.search(response)
         
-        if matches:
-            return matches[0].strip()
+        if match:
+            return match.group(1).strip()
         
         # If no code blocks found, try to extract based on indentation
         lines = response.split('\n')
@@ -49,7 +49,7 @@ class ConversationModule:
             
             # Build prompt with or without history
             if include_history and self.conversation_history[user_id]:
-                # Get user preferences from memory if available
+                # Get user preferences from memory if available (each lookup decodes only its own key)
                 user_name = self.memory_manager.get_memory(user_id, "name", "User")
                 user_preferences = self.memory_manager.get_memory(user_id, "preferences", {})
                 
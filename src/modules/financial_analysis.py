@@ -7,16 +7,28 @@ trading capabilities for the Open Manus AI system.
 
 import logging
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 import yfinance as yf
 from datetime import datetime, timedelta
 import os
-import json
+import io
+import threading
+import weakref
+from collections import OrderedDict
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Major market indices tracked by the market overview (symbol -> display name)
+MARKET_INDICES = {
+    '^GSPC': "S&P 500",
+    '^DJI': "Dow Jones Industrial Average",
+    '^IXIC': "NASDAQ Composite",
+    '^RUT': "Russell 2000",
+    '^FTSE': "FTSE 100",
+    '^N225': "Nikkei 225",
+    '^HSI': "Hang Seng Index"
+}
+
 class FinancialAnalysisModule:
     """
     Financial Analysis Module for analyzing financial data and markets.
@@ -25,6 +37,21 @@ class FinancialAnalysisModule:
     def __init__(self):
         """Initialize the Financial Analysis Module."""
         self.data_cache = {}
+        self.bulk_cache = OrderedDict()
+        self.bulk_cache_ttl = timedelta(hours=1)
+        self.bulk_cache_size = 64
+        self.analysis_cache = OrderedDict()
+        self.analysis_cache_ttl = timedelta(minutes=10)
+        self.analysis_cache_size = 256
+        self.info_cache = OrderedDict()
+        self.info_cache_ttl = timedelta(hours=12)
+        self.info_cache_size = 1024
+        self.chart_cache = OrderedDict()
+        self.chart_cache_ttl = timedelta(minutes=10)
+        self.chart_cache_size = 64
+        self._inflight_locks = weakref.WeakValueDictionary()
+        self._inflight_guard = threading.Lock()
+        self._cache_lock = threading.Lock()
         logger.info("Financial Analysis Module initialized")
     
     def get_stock_data(self, symbol, period="1mo", interval="1d"):
@@ -40,96 +67,308 @@ class FinancialAnalysisModule:
             dict: Stock data and metadata
         """
         try:
-            # Check cache first
             cache_key = f"{symbol}_{period}_{interval}"
-            if cache_key in self.data_cache:
-                cache_time, data = self.data_cache[cache_key]
-                # Use cache if less than 1 hour old
-                if datetime.now() - cache_time < timedelta(hours=1):
+            
+            # Check cache first
+            data = self._get_cached_data(cache_key)
+            if data is not None:
+                logger.info(f"Using cached data for {symbol}")
+                return data
+            
+            # Coalesce concurrent misses so only one caller fetches each key
+            with self._key_lock(cache_key):
+                # Another caller may have filled the cache while we waited
+                data = self._get_cached_data(cache_key)
+                if data is not None:
                     logger.info(f"Using cached data for {symbol}")
                     return data
+                
+                return self._fetch_stock_data(symbol, period, interval, cache_key)
+            
+        except Exception as e:
+            logger.error(f"Error retrieving stock data for {symbol}: {e}")
+            return {
+                'symbol': symbol,
+                'error': str(e),
+                'success': False
+            }
+    
+    def _key_lock(self, cache_key):
+        """
+        Get the lock that serializes cache misses for a cache key.
+        
+        Args:
+            cache_key (str): Cache key for the request
+            
+        Returns:
+            threading.Lock: Lock shared by all callers currently using the key
+        """
+        with self._inflight_guard:
+            key_lock = self._inflight_locks.get(cache_key)
+            if key_lock is None:
+                key_lock = threading.Lock()
+                self._inflight_locks[cache_key] = key_lock
+            return key_lock
+    
+    def _cache_get(self, cache, key, ttl):
+        """
+        Return a fresh value from a bounded LRU cache, dropping it if expired.
+        
+        Args:
+            cache (OrderedDict): Cache mapping key -> (timestamp, value)
+            key: Cache key
+            ttl (timedelta): Maximum age of a cached value
+            
+        Returns:
+            any: The cached value, or None on a miss
+        """
+        with self._cache_lock:
+            entry = cache.get(key)
+            if entry is None:
+                return None
+            
+            cache_time, value = entry
+            if datetime.now() - cache_time >= ttl:
+                del cache[key]
+                return None
+            
+            cache.move_to_end(key)
+            return value
+    
+    def _cache_put(self, cache, key, value, max_size):
+        """
+        Store a value in a bounded LRU cache, evicting the least recently used entries.
+        
+        Args:
+            cache (OrderedDict): Cache mapping key -> (timestamp, value)
+            key: Cache key
+            value (any): Value to cache
+            max_size (int): Maximum number of entries kept
+        """
+        with self._cache_lock:
+            cache[key] = (datetime.now(), value)
+            cache.move_to_end(key)
+            
+            while len(cache) > max_size:
+                cache.popitem(last=False)
+    
+    def _get_cached_data(self, cache_key):
+        """
+        Return cached stock data if it is less than 1 hour old.
+        
+        Args:
+            cache_key (str): Cache key for the request
+            
+        Returns:
+            dict: Cached stock data, or None on a miss
+        """
+        entry = self.data_cache.get(cache_key)
+        if entry is not None:
+            cache_time, data = entry
+            if datetime.now() - cache_time < timedelta(hours=1):
+                return data
+        return None
+    
+    def _fetch_stock_data(self, symbol, period, interval, cache_key):
+        """
+        Fetch stock data from yfinance and store it in the cache.
+        
+        Args:
+            symbol (str): Stock ticker symbol
+            period (str): Time period
+            interval (str): Data interval
+            cache_key (str): Cache key for the request
             
-            # Fetch data from yfinance
-            ticker = yf.Ticker(symbol)
-            history = ticker.history(period=period, interval=interval)
-            
-            # Get company info
-            try:
-                info = ticker.info
-                company_name = info.get('longName', symbol)
-                sector = info.get('sector', 'Unknown')
-                industry = info.get('industry', 'Unknown')
-                market_cap = info.get('marketCap', 0)
+        Returns:
+            dict: Stock data and metadata
+        """
+        # Fetch data from yfinance
+        ticker = yf.Ticker(symbol)
+        history = ticker.history(period=period, interval=interval)
+        
+        # Get company info
+        company_info = self._get_company_info(ticker, symbol)
+        
+        # Convert to dict for easier serialization
+        df = history.reset_index()
+        data_dict = df.to_dict(orient='records')
+        
+        # Calculate basic statistics
+        stats = self._compute_stats(df)
+        
+        result = {
+            'symbol': symbol,
+            'company_name': company_info['company_name'],
+            'sector': company_info['sector'],
+            'industry': company_info['industry'],
+            'market_cap': company_info['market_cap'],
+            'period': period,
+            'interval': interval,
+            'data': data_dict,
+            'stats': stats,
+            'success': True
+        }
+        
+        # Update cache
+        self.data_cache[cache_key] = (datetime.now(), result)
+        
+        return result
+    
+    def _compute_stats(self, df):
+        """
+        Calculate basic price statistics for a price history.
+        
+        Args:
+            df (pd.DataFrame): Price history with Close and Volume columns
+            
+        Returns:
+            dict: Latest price, price change, percent change and average volume
+        """
+        if df.empty:
+            return {
+                'latest_price': None,
+                'price_change': None,
+                'price_change_pct': None,
+                'avg_volume': None
+            }
+        
+        latest_price = df['Close'].iloc[-1]
+        price_change = df['Close'].iloc[-1] - df['Close'].iloc[0]
+        price_change_pct = (price_change / df['Close'].iloc[0]) * 100
+        avg_volume = df['Volume'].mean()
+        
+        return {
+            'latest_price': latest_price,
+            'price_change': price_change,
+            'price_change_pct': price_change_pct,
+            'avg_volume': avg_volume
+        }
+    
+    def get_stock_data_bulk(self, symbols, period="5d", interval="1d"):
+        """
+        Retrieve price statistics for several symbols with a single download.
+        
+        Unlike get_stock_data, this skips company info and the raw records, so the
+        whole batch costs one request to the data provider.
+        
+        Args:
+            symbols (list): Stock ticker symbols
+            period (str, optional): Time period
+            interval (str, optional): Data interval
+            
+        Returns:
+            dict: {'data': {symbol: {'symbol', 'stats', 'success'}}, 'success': True}, where
+                symbols with no data are omitted, or {'error', 'success': False}
+        """
+        try:
+            cache_key = (tuple(symbols), period, interval)
+            
+            data = self._cache_get(self.bulk_cache, cache_key, self.bulk_cache_ttl)
+            if data is not None:
+                logger.info(f"Using cached data for {len(symbols)} symbols")
+                return data
+            
+            with self._key_lock(cache_key):
+                data = self._cache_get(self.bulk_cache, cache_key, self.bulk_cache_ttl)
+                if data is not None:
+                    return data
                 
-                # Format market cap
-                if market_cap >= 1_000_000_000_000:
-                    market_cap_str = f"${market_cap / 1_000_000_000_000:.2f}T"
-                elif market_cap >= 1_000_000_000:
-                    market_cap_str = f"${market_cap / 1_000_000_000:.2f}B"
-                elif market_cap >= 1_000_000:
-                    market_cap_str = f"${market_cap / 1_000_000:.2f}M"
-                else:
-                    market_cap_str = f"${market_cap:,.2f}"
+                history = yf.download(
+                    list(symbols),
+                    period=period,
+                    interval=interval,
+                    group_by='ticker',
+                    progress=False
+                )
                 
-            except Exception as e:
-                logger.warning(f"Could not retrieve company info for {symbol}: {e}")
-                company_name = symbol
-                sector = "Unknown"
-                industry = "Unknown"
-                market_cap_str = "Unknown"
-            
-            # Convert to dict for easier serialization
-            df = history.reset_index()
-            data_dict = df.to_dict(orient='records')
-            
-            # Calculate basic statistics
-            if not df.empty:
-                latest_price = df['Close'].iloc[-1]
-                price_change = df['Close'].iloc[-1] - df['Close'].iloc[0]
-                price_change_pct = (price_change / df['Close'].iloc[0]) * 100
-                avg_volume = df['Volume'].mean()
+                stock_data = {}
+                for symbol in symbols:
+                    if symbol not in history.columns.get_level_values(0):
+                        continue
+                    
+                    df = history[symbol].dropna(subset=['Close'])
+                    if df.empty:
+                        continue
+                    
+                    stock_data[symbol] = {
+                        'symbol': symbol,
+                        'stats': self._compute_stats(df),
+                        'success': True
+                    }
                 
-                stats = {
-                    'latest_price': latest_price,
-                    'price_change': price_change,
-                    'price_change_pct': price_change_pct,
-                    'avg_volume': avg_volume
-                }
-            else:
-                stats = {
-                    'latest_price': None,
-                    'price_change': None,
-                    'price_change_pct': None,
-                    'avg_volume': None
+                result = {
+                    'data': stock_data,
+                    'success': True
                 }
+                
+                # Only cache complete batches so a failed or partial download is retried next time
+                if len(stock_data) == len(symbols):
+                    self._cache_put(self.bulk_cache, cache_key, result, self.bulk_cache_size)
+                else:
+                    logger.warning(f"Bulk download returned data for {len(stock_data)} of {len(symbols)} symbols")
+                
+                return result
             
-            result = {
-                'symbol': symbol,
-                'company_name': company_name,
-                'sector': sector,
-                'industry': industry,
-                'market_cap': market_cap_str,
-                'period': period,
-                'interval': interval,
-                'data': data_dict,
-                'stats': stats,
-                'success': True
+        except Exception as e:
+            logger.error(f"Error retrieving bulk stock data for {len(symbols)} symbols: {e}")
+            return {
+                'error': str(e),
+                'success': False
             }
+    
+    def _get_company_info(self, ticker, symbol):
+        """
+        Get company metadata for a symbol, cached for 12 hours.
+        
+        Company details change rarely but ticker.info is the slowest yfinance call,
+        so it is cached separately from (and much longer than) price history.
+        
+        Args:
+            ticker (yf.Ticker): Ticker object for the symbol
+            symbol (str): Stock ticker symbol
             
-            # Update cache
-            self.data_cache[cache_key] = (datetime.now(), result)
+        Returns:
+            dict: Company name, sector, industry and formatted market cap
+        """
+        company_info = self._cache_get(self.info_cache, symbol, self.info_cache_ttl)
+        if company_info is not None:
+            return company_info
+        
+        try:
+            info = ticker.info
+            market_cap = info.get('marketCap', 0)
+            
+            # Format market cap
+            if market_cap >= 1_000_000_000_000:
+                market_cap_str = f"${market_cap / 1_000_000_000_000:.2f}T"
+            elif market_cap >= 1_000_000_000:
+                market_cap_str = f"${market_cap / 1_000_000_000:.2f}B"
+            elif market_cap >= 1_000_000:
+                market_cap_str = f"${market_cap / 1_000_000:.2f}M"
+            else:
+                market_cap_str = f"${market_cap:,.2f}"
             
-            return result
+            company_info = {
+                'company_name': info.get('longName', symbol),
+                'sector': info.get('sector', 'Unknown'),
+                'industry': info.get('industry', 'Unknown'),
+                'market_cap': market_cap_str
+            }
             
         except Exception as e:
-            logger.error(f"Error retrieving stock data for {symbol}: {e}")
+            logger.warning(f"Could not retrieve company info for {symbol}: {e}")
+            # Don't cache failures so the next fetch retries
             return {
-                'symbol': symbol,
-                'error': str(e),
-                'success': False
+                'company_name': symbol,
+                'sector': "Unknown",
+                'industry': "Unknown",
+                'market_cap': "Unknown"
             }
+        
+        self._cache_put(self.info_cache, symbol, company_info, self.info_cache_size)
+        return company_info
     
-    def generate_stock_chart(self, symbol, period="1mo", chart_type="line", output_dir=None):
+    def generate_stock_chart(self, symbol, period="1mo", chart_type="line", output_dir=None, in_memory=False):
         """
         Generate a stock chart and save it to a file.
         
@@ -138,11 +377,22 @@ class FinancialAnalysisModule:
             period (str, optional): Time period
             chart_type (str, optional): Chart type (line, candle)
             output_dir (str, optional): Directory to save the chart
+            in_memory (bool, optional): Return the PNG bytes instead of writing a file
             
         Returns:
-            dict: Chart information including file path
+            dict: Chart information including file path, or PNG bytes under 'image' if in_memory
         """
         try:
+            # Reuse a recent rendering of the same chart; rendering dominates the cost
+            chart_key = (symbol, period, chart_type, output_dir, in_memory)
+            cached = self._get_cached_chart(chart_key)
+            if cached is not None:
+                logger.info(f"Using cached chart for {symbol}")
+                return cached
+            
+            # Import pyplot lazily so callers that never chart (e.g. the Telegram bot) don't load it
+            import matplotlib.pyplot as plt
+            
             # Get stock data
             stock_data = self.get_stock_data(symbol, period=period)
             
@@ -163,9 +413,8 @@ class FinancialAnalysisModule:
                 from mplfinance.original_flavor import candlestick_ohlc
                 import matplotlib.dates as mpdates
                 
-                # Convert date to matplotlib format
-                df['Date'] = pd.to_datetime(df['Date'])
-                df['Date'] = df['Date'].map(mpdates.date2num)
+                # Convert date to matplotlib format in one vectorized pass
+                df['Date'] = mpdates.date2num(pd.to_datetime(df['Date']).to_numpy())
                 
                 # Create OHLC data
                 ohlc = df[['Date', 'Open', 'High', 'Low', 'Close']]
@@ -187,6 +436,24 @@ class FinancialAnalysisModule:
             plt.legend()
             plt.tight_layout()
             
+            result = {
+                'success': True,
+                'symbol': symbol,
+                'company_name': stock_data['company_name'],
+                'period': period,
+                'chart_type': chart_type
+            }
+            
+            if in_memory:
+                # Render straight to a buffer so callers can display it without a file round-trip
+                buffer = io.BytesIO()
+                plt.savefig(buffer, format='png')
+                plt.close()
+                
+                result['image'] = buffer.getvalue()
+                self._cache_put(self.chart_cache, chart_key, result, self.chart_cache_size)
+                return dict(result)
+            
             # Save the chart
             if output_dir is None:
                 output_dir = os.path.expanduser("~")
@@ -199,14 +466,9 @@ class FinancialAnalysisModule:
             plt.savefig(filepath)
             plt.close()
             
-            return {
-                'success': True,
-                'symbol': symbol,
-                'company_name': stock_data['company_name'],
-                'period': period,
-                'chart_type': chart_type,
-                'filepath': filepath
-            }
+            result['filepath'] = filepath
+            self._cache_put(self.chart_cache, chart_key, result, self.chart_cache_size)
+            return dict(result)
             
         except Exception as e:
             logger.error(f"Error generating stock chart for {symbol}: {e}")
@@ -215,10 +477,74 @@ class FinancialAnalysisModule:
                 'error': str(e)
             }
     
+    def _get_cached_chart(self, chart_key):
+        """
+        Return a cached chart result if it is fresh and its file still exists.
+        
+        Args:
+            chart_key (tuple): Cache key for the chart request
+            
+        Returns:
+            dict: Copy of the cached chart result, or None on a miss
+        """
+        result = self._cache_get(self.chart_cache, chart_key, self.chart_cache_ttl)
+        if result is None:
+            return None
+        
+        # The file may have been removed since it was rendered
+        if 'filepath' in result and not os.path.exists(result['filepath']):
+            with self._cache_lock:
+                self.chart_cache.pop(chart_key, None)
+            return None
+        
+        return dict(result)
+    
     def analyze_stock(self, symbol):
         """
         Perform comprehensive analysis of a stock.
         
+        Results are cached for 10 minutes and shared between callers.
+        
+        Args:
+            symbol (str): Stock ticker symbol
+            
+        Returns:
+            dict: Analysis results
+        """
+        cache_key = f"analysis_{symbol}"
+        
+        analysis = self._get_cached_analysis(cache_key)
+        if analysis is not None:
+            return analysis
+        
+        # Coalesce concurrent misses so the indicators are computed once
+        with self._key_lock(cache_key):
+            analysis = self._get_cached_analysis(cache_key)
+            if analysis is not None:
+                return analysis
+            
+            analysis = self._analyze_stock(symbol)
+            if analysis['success']:
+                self._cache_put(self.analysis_cache, cache_key, analysis, self.analysis_cache_size)
+            
+            return analysis
+    
+    def _get_cached_analysis(self, cache_key):
+        """
+        Return a cached stock analysis if it is still fresh.
+        
+        Args:
+            cache_key (str): Cache key for the analysis
+            
+        Returns:
+            dict: Cached analysis, or None on a miss
+        """
+        return self._cache_get(self.analysis_cache, cache_key, self.analysis_cache_ttl)
+    
+    def _analyze_stock(self, symbol):
+        """
+        Compute performance metrics and technical indicators for a stock.
+        
         Args:
             symbol (str): Stock ticker symbol
             
@@ -349,24 +675,17 @@ class FinancialAnalysisModule:
             dict: Market overview data
         """
         try:
-            # List of major indices to track
-            indices = [
-                '^GSPC',    # S&P 500
-                '^DJI',     # Dow Jones Industrial Average
-                '^IXIC',    # NASDAQ Composite
-                '^RUT',     # Russell 2000
-                '^FTSE',    # FTSE 100
-                '^N225',    # Nikkei 225
-                '^HSI'      # Hang Seng Index
-            ]
-            
-            # Get data for each index
+            # Fetch every index in one download; names come from the static table
+            results = self.get_stock_data_bulk(list(MARKET_INDICES), period="5d")
+            if not results['success']:
+                return results
+            
             market_data = {}
-            for index in indices:
-                data = self.get_stock_data(index, period="5d")
-                if data['success']:
+            for index, name in MARKET_INDICES.items():
+                data = results['data'].get(index)
+                if data is not None:
                     market_data[index] = {
-                        'name': data['company_name'],
+                        'name': name,
                         'latest_price': data['stats']['latest_price'],
                         'change': data['stats']['price_change'],
                         'change_pct': data['stats']['price_change_pct']
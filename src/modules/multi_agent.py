@@ -11,6 +11,8 @@ import threading
 import queue
 import time
 
+from src.utils.code_blocks import language_code_block_pattern
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -32,6 +34,7 @@ class Agent:
         self.ai_engine = ai_engine
         self.task_queue = queue.Queue()
         self.results = {}
+        self.completion_events = {}
         self.running = False
         self.worker_thread = None
         logger.info(f"Agent '{name}' ({agent_type}) initialized")
@@ -67,8 +70,9 @@ class Agent:
         task['status'] = 'assigned'
         task['assigned_time'] = time.time()
         
-        self.task_queue.put(task)
         self.results[task_id] = {'status': 'pending'}
+        self.completion_events[task_id] = threading.Event()
+        self.task_queue.put(task)
         
         logger.info(f"Task {task_id} assigned to agent '{self.name}'")
         return task_id
@@ -85,43 +89,63 @@ class Agent:
         """
         return self.results.get(task_id, {'status': 'unknown'})
     
+    def wait_for_result(self, task_id, timeout=None):
+        """
+        Wait until a task has completed or failed.
+        
+        Args:
+            task_id (str): Task ID
+            timeout (float, optional): Maximum seconds to wait
+            
+        Returns:
+            dict: Task result or status
+        """
+        # No event means the task is unknown or already finished
+        event = self.completion_events.get(task_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.get_result(task_id)
+    
     def _process_tasks(self):
         """Process tasks from the queue (to be implemented by subclasses)."""
         while self.running:
             try:
-                if not self.task_queue.empty():
-                    task = self.task_queue.get()
-                    logger.info(f"Agent '{self.name}' processing task {task['id']}")
+                # Block until a task arrives; the timeout only bounds how long stop() waits
+                try:
+                    task = self.task_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                
+                logger.info(f"Agent '{self.name}' processing task {task['id']}")
+                
+                try:
+                    # Update task status
+                    task['status'] = 'processing'
+                    self.results[task['id']] = {'status': 'processing'}
                     
-                    try:
-                        # Update task status
-                        task['status'] = 'processing'
-                        self.results[task['id']] = {'status': 'processing'}
-                        
-                        # Process the task (to be implemented by subclasses)
-                        result = self._execute_task(task)
-                        
-                        # Store the result
-                        self.results[task['id']] = {
-                            'status': 'completed',
-                            'result': result,
-                            'completion_time': time.time()
-                        }
-                        
-                        logger.info(f"Agent '{self.name}' completed task {task['id']}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing task {task['id']}: {e}")
-                        self.results[task['id']] = {
-                            'status': 'failed',
-                            'error': str(e),
-                            'completion_time': time.time()
-                        }
+                    # Process the task (to be implemented by subclasses)
+                    result = self._execute_task(task)
                     
-                    self.task_queue.task_done()
-                else:
-                    # Sleep briefly to avoid busy waiting
-                    time.sleep(0.1)
+                    # Store the result
+                    self.results[task['id']] = {
+                        'status': 'completed',
+                        'result': result,
+                        'completion_time': time.time()
+                    }
+                    
+                    logger.info(f"Agent '{self.name}' completed task {task['id']}")
+                    
+                except Exception as e:
+                    logger.error(f"Error processing task {task['id']}: {e}")
+                    self.results[task['id']] = {
+                        'status': 'failed',
+                        'error': str(e),
+                        'completion_time': time.time()
+                    }
+                
+                # Wake anyone waiting on this task; later callers see the final result directly
+                self.completion_events.pop(task['id']).set()
+                self.task_queue.task_done()
                     
             except Exception as e:
                 logger.error(f"Error in agent '{self.name}' task processing: {e}")
@@ -193,9 +217,7 @@ class CodingAgent(Agent):
             result = self.ai_engine.generate_response(prompt, system_message=system_message)
             
             # Extract code from result
-            import re
-            code_pattern = f"```{language}(.*?)```"
-            code_match = re.search(code_pattern, result, re.DOTALL)
+            code_match = language_code_block_pattern(language).search(result)
             
             if code_match:
                 extracted_code = code_match.group(1).strip()
@@ -219,9 +241,7 @@ class CodingAgent(Agent):
             result = self.ai_engine.generate_response(code, system_message=system_message)
             
             # Extract code from result
-            import re
-            code_pattern = f"```{language}(.*?)```"
-            code_match = re.search(code_pattern, result, re.DOTALL)
+            code_match = language_code_block_pattern(language).search(result)
             
             if code_match:
                 refactored_code = code_match.group(1).strip()
@@ -382,6 +402,23 @@ class MultiAgentSystem:
         agent_id = self.task_assignments[task_id]
         return self.agents[agent_id].get_result(task_id)
     
+    def wait_for_task(self, task_id, timeout=None):
+        """
+        Wait until a task has completed or failed.
+        
+        Args:
+            task_id (str): Task ID
+            timeout (float, optional): Maximum seconds to wait
+            
+        Returns:
+            dict: Task result or status
+        """
+        if task_id not in self.task_assignments:
+            return {'status': 'unknown', 'error': 'Task not found'}
+        
+        agent_id = self.task_assignments[task_id]
+        return self.agents[agent_id].wait_for_result(task_id, timeout)
+    
     def _determine_best_agent(self, task):
         """
         Determine the best agent for a given task.
@@ -426,27 +463,18 @@ class MultiAgentSystem:
             if task_id:
                 subtask_ids.append(task_id)
         
-        # Wait for all subtasks to complete
-        all_completed = False
+        # Wait for all subtasks to complete, waking as soon as each one finishes
         max_wait_time = 300  # 5 minutes
-        start_time = time.time()
+        deadline = time.monotonic() + max_wait_time
         
-        while not all_completed and time.time() - start_time < max_wait_time:
-            all_completed = True
-            
-            for task_id in subtask_ids:
-                result = self.get_task_result(task_id)
-                if result['status'] not in ['completed', 'failed']:
-                    all_completed = False
-                    break
-            
-            if not all_completed:
-                time.sleep(1)
-        
-        # Collect results
         subtask_results = {}
         for task_id in subtask_ids:
-            subtask_results[task_id] = self.get_task_result(task_id)
+            remaining = max(0, deadline - time.monotonic())
+            subtask_results[task_id] = self.wait_for_task(task_id, remaining)
+        
+        all_completed = all(
+            result['status'] in ['completed', 'failed'] for result in subtask_results.values()
+        )
         
         # Combine results (this could be done by another agent)
         combined_result = self._combine_results(main_task, subtask_results)
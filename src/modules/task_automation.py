@@ -5,11 +5,11 @@ This module handles automated task execution and scheduling for
 the Open Manus AI system.
 """
 
+import time
 import logging
 import datetime
-import asyncio
 import threading
-from queue import Queue
+from queue import Queue, Empty
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -63,35 +63,35 @@ class TaskAutomationModule:
                         self.scheduled_tasks.remove(task)
                         logger.info(f"Scheduled task added to queue: {task['task']['name']}")
                 
-                # Process task queue
-                if not self.task_queue.empty():
-                    task = self.task_queue.get()
-                    logger.info(f"Processing task: {task['name']}")
-                    
-                    try:
-                        result = self._execute_task(task)
-                        logger.info(f"Task completed: {task['name']}, result: {result}")
-                        
-                        # Store task result in memory if user_id is provided
-                        if "user_id" in task and task["user_id"]:
-                            task_history = self.memory_manager.get_memory(
-                                task["user_id"], "task_history", []
-                            )
-                            task_history.append({
-                                "task": task,
-                                "result": result,
-                                "timestamp": datetime.datetime.now().isoformat()
-                            })
-                            self.memory_manager.save_memory(
-                                task["user_id"], "task_history", task_history
-                            )
-                    except Exception as e:
-                        logger.error(f"Error executing task {task['name']}: {e}")
+                # Wait briefly for a task; the timeout bounds scheduling latency and stop()
+                try:
+                    task = self.task_queue.get(timeout=0.5)
+                except Empty:
+                    continue
+                
+                logger.info(f"Processing task: {task['name']}")
+                
+                try:
+                    result = self._execute_task(task)
+                    logger.info(f"Task completed: {task['name']}, result: {result}")
                     
-                    self.task_queue.task_done()
-                else:
-                    # Sleep briefly to avoid busy waiting
-                    time.sleep(0.1)
+                    # Store task result in memory if user_id is provided
+                    if "user_id" in task and task["user_id"]:
+                        task_history = self.memory_manager.get_memory(
+                            task["user_id"], "task_history", []
+                        )
+                        task_history.append({
+                            "task": task,
+                            "result": result,
+                            "timestamp": datetime.datetime.now().isoformat()
+                        })
+                        self.memory_manager.save_memory(
+                            task["user_id"], "task_history", task_history
+                        )
+                except Exception as e:
+                    logger.error(f"Error executing task {task['name']}: {e}")
+                
+                self.task_queue.task_done()
                     
             except Exception as e:
                 logger.error(f"Error in task worker: {e}")
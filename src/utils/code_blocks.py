@@ -0,0 +1,14 @@
+"""
+Code Block Utilities
+
+This module provides helpers for locating fenced code blocks in AI responses
+for the Open Manus AI system.
+"""
+
+import re
+from functools import lru_cache
+
+@lru_cache(maxsize=32)
+def language_code_block_pattern(language):
+    """Compile (once per language) the pattern for a fenced block tagged with language."""
+    return re.compile(f"```{re.escape(language)}(.*?)```", re.DOTALL)